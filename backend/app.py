@@ -1,335 +1,1366 @@
+import hmac
+import io
 import os
-from flask import Flask, request, jsonify, send_from_directory
+import re
+import json
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 from dotenv import load_dotenv
 from openai import OpenAI
-import requests
+from pydantic import ValidationError
 import logging
+import threading
+import time
+import wave
+import zlib
 from datetime import datetime, timedelta, timezone
-from cryptography.hazmat.primitives.serialization.pkcs12 import load_key_and_certificates
+
+from audio_segments import (
+    AudioConversionError,
+    probe_duration,
+    split_wav,
+    stitch_transcripts,
+    to_wav,
+    wav_duration,
+)
+from batch_planner import BatchPlanner
+from dispatch import dispatch_as_completed, dispatch_ordered
+from erp_client import ERPClient
+from extraction_cache import build_cache, make_cache_key
+from jobs import FINISHED, JobError, JobQueue
+from llm import EndpointConfig, FakeProvider, LLMClient, messages_tokens
+from metrics import REGISTRY, span
+from question_store import QuestionStore
+from relevance import RelevanceFilter, load_synonyms
+from sanitizer import ResponseSanitizer, load_field_rules
+from session_store import build_session_store, new_session, now_iso, start_sweeper
+from static_assets import StaticAssets
+from structured_extraction import (
+    OPTIONS_RE,
+    build_batch_model,
+    build_extraction_tool,
+    forced_tool_choice,
+    tool_arguments,
+    validate_arguments,
+)
+from transcription import Transcriber, TranscriptionBusy, spooled_request_class
 
 # Cargar variables de entorno
 load_dotenv()
 
-# Configuración para servir archivos estáticos
-app = Flask(__name__, static_folder="static", static_url_path="/")
+# Los archivos estáticos los sirve static_assets (ver serve_frontend), no Flask
+app = Flask(__name__, static_folder=None)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
-# Configurar logging
-logging.basicConfig(level=logging.DEBUG)
+# Configurar logging (LOG_LEVEL=DEBUG incluye las respuestas crudas del modelo)
+logging.basicConfig(
+    level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+logger = logging.getLogger("chatbot")
+
+# Métricas HTTP por ruta (la plantilla, no la URL, para no disparar la cardinalidad)
+http_requests = REGISTRY.counter(
+    "chatbot_http_requests_total", "Peticiones HTTP atendidas", ("route", "method", "status"))
+http_request_seconds = REGISTRY.histogram(
+    "chatbot_http_request_duration_seconds",
+    "Duración de las peticiones HTTP hasta devolver la respuesta",
+    ("route", "method"),
+)
+
+
+@app.before_request
+def start_request_timer():
+    request.environ["chatbot.start"] = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    start = request.environ.get("chatbot.start")
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    http_requests.inc(route=route, method=request.method, status=response.status_code)
+    if start is not None:
+        # En respuestas en streaming solo cuenta hasta el primer byte
+        http_request_seconds.observe(
+            time.perf_counter() - start, route=route, method=request.method)
+    return response
+
+# Inicializar cliente OpenAI ('fake' usa un proveedor local sin red para pruebas de carga)
+if os.getenv("LLM_PROVIDER", "openai") == "fake":
+    openai_client = FakeProvider.from_env()
+else:
+    try:
+        openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        if not openai_client.api_key:
+            raise ValueError("OpenAI API key not found in .env file")
+    except Exception as e:
+        logger.error("Error initializing OpenAI client: %s", e)
+        openai_client = None
+
+# Modelo, timeout y reintentos por endpoint (LLM_<ENDPOINT>_MODEL/_TIMEOUT/_RETRIES)
+# y límites de peticiones y tokens por minuto compartidos por todo el proceso
+llm_endpoints = {
+    "questions": EndpointConfig.from_env("questions", "gpt-3.5-turbo", timeout=20),
+    "extraction": EndpointConfig.from_env("extraction", "gpt-3.5-turbo", timeout=60),
+}
+# Lotes pequeños pueden ir a un modelo más barato con LLM_EXTRACTION_SMALL_MODEL
+if os.getenv("LLM_EXTRACTION_SMALL_MODEL"):
+    llm_endpoints["extraction_small"] = EndpointConfig.from_env(
+        "extraction_small", "gpt-3.5-turbo", timeout=60)
+SMALL_BATCH_FIELDS = int(os.getenv("LLM_SMALL_BATCH_FIELDS", "10"))
+
+llm = LLMClient(
+    lambda: openai_client,
+    llm_endpoints,
+    requests_per_minute=int(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")),
+    tokens_per_minute=int(os.getenv("LLM_TOKENS_PER_MINUTE", "0")),
+    rate_limit_timeout=float(os.getenv("LLM_RATE_LIMIT_TIMEOUT", "30")),
+)
+
+# Límites de /transcribe_audio (25 MB es el máximo que admite Whisper)
+TRANSCRIBE_MAX_BYTES = int(os.getenv("TRANSCRIBE_MAX_BYTES", str(25 * 1024 * 1024)))
+TRANSCRIBE_MAX_SECONDS = float(os.getenv("TRANSCRIBE_MAX_SECONDS", "600"))
+# Leer la duración real de la cabecera del audio (WAV, o con ffprobe si está instalado)
+TRANSCRIBE_MEASURE_DURATION = os.getenv("TRANSCRIBE_MEASURE_DURATION", "1") == "1"
+
+# Las subidas por debajo de este tamaño no tocan el disco
+app.request_class = spooled_request_class(
+    int(os.getenv("UPLOAD_SPOOL_BYTES", str(4 * 1024 * 1024))))
+
+# Transcripción por segmentos (?mode=chunked) para notas de voz largas
+TRANSCRIBE_CHUNKED_MAX_BYTES = int(
+    os.getenv("TRANSCRIBE_CHUNKED_MAX_BYTES", str(200 * 1024 * 1024)))
+TRANSCRIBE_CHUNKED_MAX_SECONDS = float(os.getenv("TRANSCRIBE_CHUNKED_MAX_SECONDS", "3600"))
+TRANSCRIBE_SEGMENT_SECONDS = float(os.getenv("TRANSCRIBE_SEGMENT_SECONDS", "60"))
+TRANSCRIBE_SEGMENT_OVERLAP = float(os.getenv("TRANSCRIBE_SEGMENT_OVERLAP", "3"))
+TRANSCRIBE_SEGMENT_WORKERS = int(os.getenv("TRANSCRIBE_SEGMENT_WORKERS", "4"))
+
+# Llamadas de transcripción simultáneas por proceso
+TRANSCRIBE_MAX_CONCURRENCY = int(os.getenv("TRANSCRIBE_MAX_CONCURRENCY", "4"))
+
+transcriber = Transcriber(
+    max_concurrency=TRANSCRIBE_MAX_CONCURRENCY,
+    queue_timeout=float(os.getenv("TRANSCRIBE_QUEUE_TIMEOUT", "30")),
+)
+
+# Almacenamiento de sesiones de chat: 'memory' (LRU+TTL), 'sqlite' o 'redis'
+session_store = build_session_store(
+    os.getenv("SESSION_BACKEND", "memory"),
+    ttl=int(os.getenv("SESSION_TTL", "86400")),
+    max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", "10000")),
+    max_bytes=int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024))),
+    path=os.getenv("SESSION_DB_PATH", "sessions.db"),
+    redis_url=os.getenv("REDIS_URL"),
+)
+# Limpieza periódica de sesiones caducadas (Redis caduca las claves por sí mismo)
+start_sweeper(session_store, int(os.getenv("SESSION_SWEEP_INTERVAL", "300")))
+
+
+QUESTION_SYSTEM_PROMPT = (
+    "Eres un asistente virtual que ayuda a recopilar datos específicos "
+    "sobre proyectos agrícolas. Tu tarea es formular preguntas breves, "
+    "claras y directas para obtener información concreta del usuario. "
+    "No des explicaciones ni formules preguntas largas o complejas. "
+    "Limítate a pedir directamente el dato específico indicado por el usuario."
+    "No respondas cosas como no mencionado o no disponible. "
+    "Solo rellena el campo si puedes deducirlo con alta confianza a partir del texto. "
+)
+
+# Precalentar el almacén cada vez que el proxy devuelve el catálogo del ERP
+QUESTION_STORE_AUTOWARM = os.getenv("QUESTION_STORE_AUTOWARM", "1") == "1"
+
+# Campos por llamada al generar preguntas en lote
+QUESTION_BATCH_SIZE = int(os.getenv("QUESTION_BATCH_SIZE", "25"))
+
+# Preguntas ya generadas, servidas desde memoria y persistidas en disco
+question_store = QuestionStore(
+    os.getenv("QUESTION_STORE_PATH", "question_store.json"))
+
+
+def strip_json_fences(text):
+    """Quita los bloques ```json ... ``` que a veces devuelve el modelo."""
+    text = text.strip()
+    if text.startswith("```json"):
+        text = text[7:].strip()
+    elif text.startswith("```"):
+        text = text[3:].strip()
+    if text.endswith("```"):
+        text = text[:-3].strip()
+    return text
+
+
+def generate_questions_batch(fields):
+    """Genera en una sola llamada las preguntas de varios campos."""
+    fields_prompt_list = "\n".join([f"- {field}" for field in fields])
+    messages = [
+        {"role": "system", "content": QUESTION_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": (
+                "Formula una pregunta breve y directa para pedir cada uno de estos datos. "
+                "Responde solo con un objeto JSON cuyas claves sean exactamente los datos "
+                f"indicados y cuyos valores sean las preguntas:\n{fields_prompt_list}"
+            ),
+        },
+    ]
+
+    chat_completion = llm.complete(
+        "questions",
+        messages,
+        temperature=0.1,
+        max_tokens=50 * len(fields) + 50,
+    )
+
+    content = chat_completion.choices[0].message.content
+    generated = json.loads(strip_json_fences(content))
+
+    # Ignorar claves que no se pidieron o valores vacíos
+    return {
+        field: str(generated[field]).strip()
+        for field in fields
+        if isinstance(generated.get(field), str) and generated[field].strip()
+    }
+
+
+def generate_missing_questions(missing):
+    """Genera en lote las preguntas que faltan y las guarda en el almacén."""
+    batches = [
+        missing[i:i+QUESTION_BATCH_SIZE]
+        for i in range(0, len(missing), QUESTION_BATCH_SIZE)
+    ]
+    results = dispatch_ordered(
+        generate_questions_batch, batches, EXTRACTION_MAX_WORKERS)
+
+    generated = {}
+    for result in results:
+        if result.ok:
+            generated.update(result.value)
+        else:
+            logger.error(
+                "Error al generar preguntas del lote %d: %s", result.index, result.error)
+
+    question_store.put_many(generated)
+    return generated
+
+
+def ensure_questions(fields):
+    """Devuelve las preguntas de los campos, generando en lote solo las que faltan."""
+    found, missing = question_store.split(fields)
+    if missing:
+        found.update(generate_missing_questions(missing))
+    return found
+
 
-# Inicializar cliente OpenAI
-try:
-    openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    if not openai_client.api_key:
-        raise ValueError("OpenAI API key not found in .env file")
-except Exception as e:
-    print(f"Error initializing OpenAI client: {e}")
-    openai_client = None
+# Campos que algún precalentamiento está generando ya, para no pagarlos dos veces
+_warming_fields = set()
+_warming_lock = threading.Lock()
 
-# Almacenamiento en memoria para sesiones de chat
-# En producción debería usar una base de datos real
-session_store = {}
+
+def warm_question_store(fields):
+    """Precalienta el almacén con los campos del catálogo sin bloquear la petición.
+
+    Si varias consultas llegan con el almacén frío, cada campo se genera una
+    sola vez: los que ya están en curso se omiten.
+    """
+    if not openai_client:
+        return
+    _, missing = question_store.split(fields)
+    with _warming_lock:
+        missing = [field for field in missing if field not in _warming_fields]
+        _warming_fields.update(missing)
+    if not missing:
+        return
+
+    def _warm():
+        try:
+            generate_missing_questions(missing)
+            logger.info("Almacén de preguntas precalentado con %d campos", len(missing))
+        except Exception as e:
+            logger.error("Error al precalentar el almacén de preguntas: %s", e)
+        finally:
+            with _warming_lock:
+                _warming_fields.difference_update(missing)
+
+    threading.Thread(target=_warm, daemon=True).start()
+
+
+def catalogue_descriptions(catalogue):
+    """Extrae las descripciones de preguntas de la respuesta de /api/HTDV2/consult."""
+    items = catalogue.get("data", []) if isinstance(catalogue, dict) else catalogue
+    if not isinstance(items, list):
+        return []
+    descriptions = []
+    for item in items:
+        if isinstance(item, str):
+            descriptions.append(item)
+        elif isinstance(item, dict) and item.get("Description"):
+            descriptions.append(item["Description"])
+    return descriptions
+
+
+def admin_authorized():
+    """Exige ADMIN_TOKEN en la cabecera X-Admin-Token o como 'Authorization: Bearer'.
+
+    La segunda forma es la que usa Prometheus en scrape_config (authorization).
+    Sin ADMIN_TOKEN configurado las rutas de administración quedan cerradas.
+    """
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token:
+        return False
+    token = request.headers.get("X-Admin-Token")
+    if token is None:
+        scheme, _, credentials = request.headers.get("Authorization", "").partition(" ")
+        token = credentials.strip() if scheme.lower() == "bearer" else ""
+    return hmac.compare_digest(token, admin_token)
 
 
 @app.route("/generate_question", methods=["POST"])
 def generate_question():
     data = request.json
     user_input = data.get("input")
+    # Opcional: lista de campos para obtener varias preguntas de una vez
+    user_inputs = data.get("inputs")
 
-    if not user_input:
+    if not user_input and not user_inputs:
         return jsonify({"error": "Falta el campo 'input'"}), 400
 
-    if not openai_client:
+    fields = user_inputs if user_inputs else [user_input]
+
+    # Las preguntas ya generadas se sirven sin llamar a OpenAI
+    found, missing = question_store.split(fields)
+    if missing and not openai_client:
         return jsonify({"error": "Cliente OpenAI no inicializado"}), 500
 
     try:
-        messages = [
-            {
-                "role": "system",
-                "content": (
-                    "Eres un asistente virtual que ayuda a recopilar datos específicos "
-                    "sobre proyectos agrícolas. Tu tarea es formular preguntas breves, "
-                    "claras y directas para obtener información concreta del usuario. "
-                    "No des explicaciones ni formules preguntas largas o complejas. "
-                    "Limítate a pedir directamente el dato específico indicado por el usuario."
-                    "No respondas cosas como no mencionado o no disponible. "
-                    "Solo rellena el campo si puedes deducirlo con alta confianza a partir del texto. "
-                ),
-            },
-            {
-                "role": "user",
-                "content": f"Formula una pregunta breve y directa para pedir este dato: '{user_input}'",
-            },
-        ]
-
-        chat_completion = openai_client.chat.completions.create(
-            model="gpt-3.5-turbo", messages=messages, temperature=0.1, max_tokens=50
-        )
+        questions = found
+        if missing:
+            questions.update(generate_missing_questions(missing))
+
+        if user_inputs:
+            return jsonify({"questions": questions})
 
-        generated_question = chat_completion.choices[0].message.content.strip()
+        generated_question = questions.get(user_input)
+        if not generated_question:
+            return jsonify({"error": "Error al generar la pregunta"}), 500
 
         return jsonify({"question": generated_question})
 
     except Exception as e:
-        print(f"Error al llamar a OpenAI: {e}")
+        logger.error("Error al llamar a OpenAI: %s", e)
         return jsonify({"error": "Error al generar la pregunta"}), 500
 
 
-@app.route("/extract_project_data", methods=["POST"])
-def extract_project_data():
-    data = request.json
+@app.route("/admin/question_store", methods=["GET"])
+def question_store_status():
+    if not admin_authorized():
+        return jsonify({"error": "No autorizado"}), 403
+    return jsonify(question_store.stats())
+
+
+@app.route("/admin/question_store/invalidate", methods=["POST"])
+def question_store_invalidate():
+    if not admin_authorized():
+        return jsonify({"error": "No autorizado"}), 403
+    data = request.get_json(silent=True) or {}
+    removed = question_store.invalidate(data.get("fields"))
+    return jsonify({"status": "success", "removed": removed})
+
+
+@app.route("/admin/question_store/rebuild", methods=["POST"])
+def question_store_rebuild():
+    """Regenera el almacén a partir del catálogo recibido o de los campos actuales."""
+    if not admin_authorized():
+        return jsonify({"error": "No autorizado"}), 403
+
+    if not openai_client:
+        return jsonify({"error": "Cliente OpenAI no inicializado"}), 500
+
+    data = request.get_json(silent=True) or {}
+    fields = catalogue_descriptions(data.get("questions", [])) or question_store.fields()
+
+    question_store.invalidate(fields)
+    questions = ensure_questions(fields)
+
+    return jsonify({
+        "status": "success",
+        "generated": len(questions),
+        "failed": [field for field in fields if field not in questions],
+    })
+
+
+# Número máximo de lotes de extracción enviados a OpenAI a la vez
+EXTRACTION_MAX_WORKERS = int(os.getenv("EXTRACTION_MAX_WORKERS", "4"))
+
+# Modo de extracción por defecto; cada petición puede indicar otro con 'mode'
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "text")
+
+# Filtro de valores de la respuesta; reglas por campo opcionales en SANITIZER_RULES_PATH
+response_sanitizer = ResponseSanitizer(
+    field_rules=load_field_rules(os.getenv("SANITIZER_RULES_PATH")))
+
+# Caché de resultados por lote: 'memory' (LRU con TTL), 'sqlite' (persistente) o 'none'
+extraction_cache = build_cache(
+    os.getenv("EXTRACTION_CACHE_BACKEND", "memory"),
+    ttl=int(os.getenv("EXTRACTION_CACHE_TTL", "86400")),
+    max_entries=int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "2048")),
+    path=os.getenv("EXTRACTION_CACHE_PATH", "extraction_cache.db"),
+)
+
+extraction_fallbacks = REGISTRY.counter(
+    "chatbot_extraction_fallbacks_total",
+    "Respuestas de extracción que han necesitado un parser de respaldo",
+    ("parser",),
+)
+REGISTRY.gauge(
+    "chatbot_extraction_cache_hits",
+    "Aciertos de la caché de extracción desde el arranque",
+    lambda: extraction_cache.hits,
+)
+REGISTRY.gauge(
+    "chatbot_extraction_cache_misses",
+    "Fallos de la caché de extracción desde el arranque",
+    lambda: extraction_cache.misses,
+)
+
+
+def extraction_field_line(desc):
+    """Línea del prompt de extracción para un campo, con sus opciones si las tiene."""
+    rule = response_sanitizer.rule_for(desc)
+    if rule is not None and rule.allowed:
+        return f"- {desc}{rule.prompt_hint()}"
+    return f"- {desc}"
+
+
+def build_extraction_prompt(batch, is_short_message):
+    """Construye el mensaje de sistema para un lote de campos."""
+    # Formatear campos para el prompt
+    fields_prompt_list = "\n".join(
+        [extraction_field_line(desc) for desc in batch])
+
+    # CORRECCIÓN: Usar el template adecuado según el tipo de mensaje
+    if is_short_message:
+        return (
+            "Eres un asistente experto en extraer información específica de mensajes "
+            "sobre proyectos agrícolas. Tu tarea es EXCLUSIVAMENTE extraer datos "
+            "concretos y factuales. IMPORTANTE:\n\n"
+            "1. NO generes valores como 'No mencionado', 'No disponible', 'Ninguno', etc.\n"
+            "2. Si un dato no está presente en el mensaje del usuario, OMÍTELO COMPLETAMENTE del JSON.\n"
+            "3. NUNCA inventes información ni rellenes campos con valores genéricos.\n"
+            "4. Solo extraigo datos explícitamente mencionados en el mensaje.\n\n"
+            f"Extrae los siguientes campos en formato JSON:\n{fields_prompt_list}\n\n"
+            "La omisión de un campo del JSON indica que no hay información disponible para él."
+        )
+    return (
+        "Eres un asistente experto en agricultura que extrae información estructurada "
+        "de descripciones de proyectos agrícolas. A partir del texto proporcionado por el usuario, "
+        "extrae únicamente los siguientes campos en formato JSON. "
+        "Usa exactamente los nombres de campo proporcionados:\n"
+        f"{fields_prompt_list}\n\n"
+        "Rellena solo los campos que puedas deducir con alta confianza a partir del texto. "
+        "Si algún campo no está presente o no puedes deducirlo con certeza, omítelo completamente. "
+        "No inventes datos. No añadas explicaciones o campos adicionales."
+        "IMPORTANTE: No generes valores como 'No mencionado', 'No disponible', 'No especificado', etc. "
+        "Si no hay información clara para un campo, omite ese campo completamente del JSON. "
+        "Debe interpretarse que la ausencia de un campo significa que no hay datos disponibles, "
+        "en lugar de rellenarlo con valores genéricos de 'No mencionado'."
+    )
+
+
+# Reparto de campos en lotes por presupuesto de tokens (prompt + max_tokens por llamada)
+EXTRACTION_TOKEN_BUDGET = int(os.getenv("EXTRACTION_TOKEN_BUDGET", "6000"))
+EXTRACTION_BATCH_MAX_FIELDS = int(os.getenv("EXTRACTION_BATCH_MAX_FIELDS", "40"))
+# Los mensajes cortos se extraen con más precisión en lotes más pequeños
+EXTRACTION_SHORT_BATCH_MAX_FIELDS = int(os.getenv("EXTRACTION_SHORT_BATCH_MAX_FIELDS", "20"))
+
+batch_planner = BatchPlanner(
+    extraction_field_line,
+    token_budget=EXTRACTION_TOKEN_BUDGET,
+    max_fields=EXTRACTION_BATCH_MAX_FIELDS,
+    # Mínimo de campos por lote aunque los lotes grandes fallen
+    min_fields=int(os.getenv("EXTRACTION_BATCH_MIN_FIELDS", "8")),
+    max_output_tokens=int(os.getenv("EXTRACTION_MAX_OUTPUT_TOKENS", "2000")),
+    sanitizer=response_sanitizer,
+)
+
+
+# Prefiltro local: solo se envían al modelo los campos relacionados con el mensaje.
+# Desactivado por defecto: los nombres y lugares no comparten palabras con las
+# etiquetas de los campos ("Nombre del cliente", "Municipio") y se perderían
+EXTRACTION_RELEVANCE_FILTER = os.getenv("EXTRACTION_RELEVANCE_FILTER", "0") == "1"
+
+relevance_filter = RelevanceFilter(
+    top_k=int(os.getenv("RELEVANCE_TOP_K", "40")),
+    threshold=float(os.getenv("RELEVANCE_THRESHOLD", "0.1")),
+    # Textos de campos que se envían siempre, separados por comas
+    always_fields=os.getenv("RELEVANCE_ALWAYS_FIELDS", "").split(","),
+    synonyms=load_synonyms(os.getenv("RELEVANCE_SYNONYMS_PATH")),
+)
+
+extraction_fields = REGISTRY.counter(
+    "chatbot_extraction_fields_total",
+    "Campos recibidos en las peticiones de extracción y campos enviados al modelo",
+    ("stage",),
+)
+
+
+def parse_extraction_response(extracted_data):
+    """Repara y filtra la respuesta de un lote.
+
+    Devuelve (campos válidos, parseado): parseado es False si el JSON no se pudo
+    reparar y los campos salen de la extracción por expresiones regulares.
+    """
+    try:
+        with span("extraction.repair"):
+            # Limpieza del formato JSON
+            extracted_data = strip_json_fences(extracted_data)
+
+            # Correcciones de formato
+            if extracted_data.endswith(","):
+                extracted_data = extracted_data[:-1] + "}"
+
+            if not extracted_data.startswith("{"):
+                extracted_data = "{" + extracted_data
+            if not extracted_data.endswith("}"):
+                extracted_data = extracted_data + "}"
+
+            # Parsear el JSON
+            extracted_json = json.loads(extracted_data)
+
+        with span("extraction.filter"):
+            return response_sanitizer.sanitize(extracted_json), True
+
+    except json.JSONDecodeError as json_err:
+        extraction_fallbacks.inc(parser="regex")
+        logger.warning("Error parsing JSON: %s", json_err)
+        logger.debug("Raw response: %s", extracted_data)
+
+        # Plan B: Crear un JSON con los campos que podamos extraer
+        fallback_fields = {}
+        try:
+            # Regex para extraer pares clave-valor
+            pairs = re.findall(
+                r'"([^"]+)"\s*:\s*("[^"]*"|null|\d+|true|false)', extracted_data)
+
+            if pairs:
+                fallback_json = "{"
+                for i, (key, value) in enumerate(pairs):
+                    fallback_json += f'"{key}":{value}'
+                    if i < len(pairs) - 1:
+                        fallback_json += ","
+                fallback_json += "}"
+
+                extracted_json = json.loads(fallback_json)
+
+                # Registrar solo los campos autocompletados
+                for field, value in extracted_json.items():
+                    if value is not None and value != "" and value != "null":
+                        fallback_fields[field] = value
+        except:
+            pass
+
+        return fallback_fields, False
+
+
+def extraction_endpoint(batch):
+    """Endpoint LLM del lote: los lotes pequeños pueden ir a un modelo más barato."""
+    if llm.has("extraction_small") and len(batch) <= SMALL_BATCH_FIELDS:
+        return "extraction_small"
+    return "extraction"
+
+
+def request_batch_completion(batch, system_content, project_description, mode, max_tokens=1000):
+    """Llama a OpenAI para un lote.
+
+    Devuelve (campos filtrados, truncado, fallo de parseo): truncado indica que
+    la respuesta se cortó por max_tokens.
+    """
+    endpoint = extraction_endpoint(batch)
+    messages = [
+        {"role": "system", "content": system_content},
+        {"role": "user", "content": project_description}
+    ]
+
+    if mode != "structured":
+        chat_completion = llm.complete(
+            endpoint,
+            messages,
+            temperature=0.0,
+            max_tokens=max_tokens
+        )
+        truncated = chat_completion.choices[0].finish_reason == "length"
+
+        extracted_data = chat_completion.choices[0].message.content.strip()
+        filtered, parsed = parse_extraction_response(extracted_data)
+        return filtered, truncated, not parsed
+
+    # Modo estructurado: el esquema se construye con los campos del lote y las
+    # listas de opciones se convierten en enumeraciones
+    model = build_batch_model(tuple(batch), response_sanitizer)
+    chat_completion = llm.complete(
+        endpoint,
+        messages,
+        temperature=0.0,
+        max_tokens=max_tokens,
+        tools=[build_extraction_tool(model)],
+        tool_choice=forced_tool_choice(),
+    )
+    truncated = chat_completion.choices[0].finish_reason == "length"
+
+    arguments = tool_arguments(chat_completion)
+    try:
+        with span("extraction.validate"):
+            validated = validate_arguments(model, arguments)
+    except ValidationError as e:
+        # Si no encaja con el esquema se recurre al parser tolerante
+        extraction_fallbacks.inc(parser="schema")
+        logger.warning("Respuesta estructurada no válida, usando el parser de respaldo: %s", e)
+        filtered, parsed = parse_extraction_response(arguments)
+        return filtered, truncated, not parsed
+    with span("extraction.filter"):
+        return response_sanitizer.sanitize(validated), truncated, False
+
+
+def process_extraction_batch(batch, project_description, is_short_message, mode="text"):
+    """Envía un lote planificado a OpenAI y devuelve los campos extraídos."""
+    fields = batch.fields
+    with span("extraction.prompt"):
+        system_content = build_extraction_prompt(fields, is_short_message)
+
+    # El prompt de sistema ya incluye la plantilla y los campos del lote
+    with span("extraction.cache"):
+        cache_key = make_cache_key(
+            llm.model_for(extraction_endpoint(fields)), mode, system_content, project_description)
+        cached = extraction_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    filtered, truncated, parse_failed = request_batch_completion(
+        fields, system_content, project_description, mode, batch.max_tokens)
+    batch_planner.record(batch.shape, truncated, parse_failed)
+    # Una respuesta cortada o ilegible no se guarda: repetir la petición debe
+    # volver a llamar al modelo en lugar de devolver el mismo resultado vacío
+    if not truncated and not parse_failed:
+        extraction_cache.set(cache_key, filtered)
+    return filtered
+
+
+def confirmed_fields(session, fields, field_ids=None):
+    """Campos que ya tienen respuesta confirmada en la sesión.
+
+    Una respuesta cuenta si su clave es el campo, el campo sin la lista de
+    opciones o, si la petición trae 'questionIds', el identificador del campo.
+    """
+    keys = {str(key) for key in session.get("answers", {})}
+    confirmed = set()
+    for i, field in enumerate(fields):
+        candidates = {field, OPTIONS_RE.sub("", field).strip()}
+        if field_ids and i < len(field_ids) and field_ids[i] is not None:
+            candidates.add(str(field_ids[i]))
+        if candidates & keys:
+            confirmed.add(field)
+    return confirmed
+
+
+def begin_extraction_turn(session_id):
+    """Abre un turno de extracción en la sesión (creándola si no existe)."""
+    def next_turn(session):
+        session["turn"] = session.get("turn", 0) + 1
+        session.setdefault("extracted", {})
+
+    with span("session_store.update"):
+        return session_store.update(session_id, next_turn, create=True)
+
+
+def merge_session_extraction(session_id, turn, values, mode):
+    """Guarda los valores extraídos con su procedencia y devuelve solo los que cambian."""
+    delta = {}
+
+    def merge(session):
+        # Los almacenes con reintentos optimistas pueden aplicar merge más de una vez
+        delta.clear()
+        extracted = session.setdefault("extracted", {})
+        # Lo que el usuario ya ha confirmado prevalece sobre lo que diga el modelo
+        confirmed = confirmed_fields(session, list(values))
+        for field, value in values.items():
+            if field in confirmed:
+                continue
+            previous = extracted.get(field)
+            if previous is not None and previous.get("value") == value:
+                continue
+            extracted[field] = {
+                "value": value,
+                "source": f"extraction:{mode}",
+                "turn": turn,
+                "updated_at": now_iso(),
+            }
+            delta[field] = value
+
+    with span("session_store.update"):
+        session = session_store.update(session_id, merge)
+    # Si la sesión ha caducado entre medias, todo es nuevo para el cliente
+    return delta if session is not None else dict(values)
+
+
+def prepare_extraction(data):
+    """Valida la petición de extracción y la divide en lotes.
+
+    Devuelve (error, plan): error es una respuesta Flask lista para devolver o
+    None; plan es un diccionario con la descripción, los lotes y su tamaño.
+    """
     project_description = data.get("description")
     # Lista de todas las descripciones
     question_descriptions = data.get("questionDescriptions", [])
 
     if not project_description:
-        return jsonify({"error": "Falta el campo 'description'"}), 400
+        return (jsonify({"error": "Falta el campo 'description'"}), 400), None
 
     if not openai_client:
-        return jsonify({"error": "Cliente OpenAI no inicializado"}), 500
+        return (jsonify({"error": "Cliente OpenAI no inicializado"}), 500), None
+
+    # 'text' (JSON libre reparado a mano) o 'structured' (llamada a herramienta con esquema)
+    mode = data.get("mode", EXTRACTION_MODE)
+    if mode not in ("text", "structured"):
+        return (jsonify({"error": f"Modo de extracción no válido: {mode}"}), 400), None
 
     # MEJORA: Detectar si es un mensaje corto para optimizar el prompt
     is_short_message = len(project_description.split()) < 30
 
-    # Para mensajes cortos, usar lotes más pequeños para mejorar precisión
-    batch_size = 10 if is_short_message else 30
+    requested = len(question_descriptions)
 
-    # Debug info
-    print(
-        f"Procesando mensaje {'corto' if is_short_message else 'largo'} con batch_size={batch_size}")
-    print(f"Cantidad de campos a extraer: {len(question_descriptions)}")
+    # Con 'session_id' no se vuelve a preguntar por los campos ya confirmados
+    session_id = data.get("session_id")
+    turn = None
+    answered = 0
+    if session_id:
+        session = begin_extraction_turn(session_id)
+        turn = session["turn"]
+        confirmed = confirmed_fields(
+            session, question_descriptions, data.get("questionIds"))
+        question_descriptions = [f for f in question_descriptions if f not in confirmed]
+        answered = requested - len(question_descriptions)
+
+    # Descartar los campos que el mensaje no puede responder ('fullScan' los envía todos)
+    if EXTRACTION_RELEVANCE_FILTER and not data.get("fullScan", False):
+        with span("extraction.relevance"):
+            question_descriptions, _ = relevance_filter.select(
+                question_descriptions, project_description, data.get("requiredFields", []))
+    extraction_fields.inc(requested, stage="requested")
+    extraction_fields.inc(len(question_descriptions), stage="dispatched")
+
+    # Los lotes se llenan hasta el presupuesto de tokens; lo que paga toda
+    # llamada por igual es la plantilla sin campos más la descripción
+    fixed_tokens = messages_tokens([
+        {"content": build_extraction_prompt([], is_short_message)},
+        {"content": project_description},
+    ])
+    with span("extraction.plan"):
+        batches = batch_planner.plan(
+            question_descriptions,
+            fixed_tokens,
+            mode,
+            max_fields=EXTRACTION_SHORT_BATCH_MAX_FIELDS if is_short_message else None,
+        )
 
-    # Almacenar resultados
-    all_extracted_data = {}
-    auto_completed_fields = []  # Lista para seguir qué campos fueron autocompletados
+    logger.debug(
+        "Procesando mensaje %s: %d de %d campos en %d lotes",
+        "corto" if is_short_message else "largo",
+        len(question_descriptions), requested, len(batches))
+
+    return None, {
+        "description": project_description,
+        "is_short_message": is_short_message,
+        "mode": mode,
+        "batches": batches,
+        "skipped": requested - answered - len(question_descriptions),
+        "session_id": session_id,
+        "turn": turn,
+        "answered": answered,
+    }
 
-    for i in range(0, len(question_descriptions), batch_size):
-        batch = question_descriptions[i:i+batch_size]
 
-        # Preparar lista de campos para este lote
-        fields_to_extract = []
-        for desc in batch:
-            if "Tipo De Oferta" in desc:
-                fields_to_extract.append(
-                    f"- {desc} (opciones válidas exactas: 'B (En firme)', 'A (Estimada)', 'NINGUNO')")
-            else:
-                fields_to_extract.append(desc)
-
-        # Formatear campos para el prompt
-        fields_prompt_list = "\n".join(
-            [f"- {field}" for field in fields_to_extract])
-
-        # CORRECCIÓN: Usar el template adecuado según el tipo de mensaje
-        if is_short_message:
-            system_content = (
-                "Eres un asistente experto en extraer información específica de mensajes "
-                "sobre proyectos agrícolas. Tu tarea es EXCLUSIVAMENTE extraer datos "
-                "concretos y factuales. IMPORTANTE:\n\n"
-                "1. NO generes valores como 'No mencionado', 'No disponible', 'Ninguno', etc.\n"
-                "2. Si un dato no está presente en el mensaje del usuario, OMÍTELO COMPLETAMENTE del JSON.\n"
-                "3. NUNCA inventes información ni rellenes campos con valores genéricos.\n"
-                "4. Solo extraigo datos explícitamente mencionados en el mensaje.\n\n"
-                f"Extrae los siguientes campos en formato JSON:\n{fields_prompt_list}\n\n"
-                "La omisión de un campo del JSON indica que no hay información disponible para él."
-            )
-        else:
-            system_content = (
-                "Eres un asistente experto en agricultura que extrae información estructurada "
-                "de descripciones de proyectos agrícolas. A partir del texto proporcionado por el usuario, "
-                "extrae únicamente los siguientes campos en formato JSON. "
-                "Usa exactamente los nombres de campo proporcionados:\n"
-                f"{fields_prompt_list}\n\n"
-                "Rellena solo los campos que puedas deducir con alta confianza a partir del texto. "
-                "Si algún campo no está presente o no puedes deducirlo con certeza, omítelo completamente. "
-                "No inventes datos. No añadas explicaciones o campos adicionales."
-                "IMPORTANTE: No generes valores como 'No mencionado', 'No disponible', 'No especificado', etc. "
-                "Si no hay información clara para un campo, omite ese campo completamente del JSON. "
-                "Debe interpretarse que la ausencia de un campo significa que no hay datos disponibles, "
-                "en lugar de rellenarlo con valores genéricos de 'No mencionado'."
-            )
+def extraction_worker(plan):
+    """Función que procesa un lote del plan, apta para los despachadores."""
+    return lambda batch: process_extraction_batch(
+        batch, plan["description"], plan["is_short_message"], plan["mode"])
 
-        try:
-            messages = [
-                {"role": "system", "content": system_content},
-                {"role": "user", "content": project_description}
-            ]
-
-            chat_completion = openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                temperature=0.0,
-                max_tokens=1000
-            )
 
-            extracted_data = chat_completion.choices[0].message.content.strip()
-
-            # Reemplazar el bloque de procesamiento JSON existente con este:
-            import json
-            try:
-                # Limpieza del formato JSON
-                extracted_data = extracted_data.strip()
-
-                if extracted_data.startswith("```json"):
-                    extracted_data = extracted_data[7:].strip()
-                elif extracted_data.startswith("```"):
-                    extracted_data = extracted_data[3:].strip()
-                if extracted_data.endswith("```"):
-                    extracted_data = extracted_data[:-3].strip()
-
-                # Correcciones de formato
-                if extracted_data.endswith(","):
-                    extracted_data = extracted_data[:-1] + "}"
-
-                if not extracted_data.startswith("{"):
-                    extracted_data = "{" + extracted_data
-                if not extracted_data.endswith("}"):
-                    extracted_data = extracted_data + "}"
-
-                # Parsear el JSON
-                extracted_json = json.loads(extracted_data)
-
-                # Expandir la lista de valores no deseados
-                unwanted_values = [
-                    # Valores negativos o indeterminados
-                    "no mencionado", "no especificado", "no disponible", "no indicado",
-                    "desconocido", "sin especificar", "n/a", "na", "no aplica",
-                    "-- selecciona --", "seleccione", "selecciona",
-                    "no se especifica", "por determinar", "por definir",
-
-                    # Valores vacíos o genéricos
-                    "false", "true", "none", "null", "undefined", "ninguno", "ninguna",
-                    "dato no proporcionado", "información no disponible", "vacio", "vacío",
-                    "no hay datos", "pendiente", "a confirmar",
-
-                    # Variaciones con mayúsculas
-                    "NO MENCIONADO", "NO ESPECIFICADO", "NO DISPONIBLE", "NINGUNO", "NINGUNA",
-
-                    # Valores imprecisos o no informativos
-                    "normal", "estándar", "estandar", "regular", "común", "comun",
-                    "varios", "multiple", "multiples", "múltiples"
-                ]
-
-                # Modificar el filtrado para ser más estricto
-                filtered_json = {}
-                for field, value in extracted_json.items():
-                    if isinstance(value, str):
-                        # Normalizar: minúsculas, sin puntuación
-                        normalized = value.lower().strip().strip('.').strip(',')
-
-                        # Rechazar valores muy cortos no numéricos (probablemente no son respuestas válidas)
-                        if len(normalized) < 2 and not normalized.isdigit():
-                            continue
-
-                        # Rechazar valores que están en la lista de no deseados o que contienen subcadenas no deseadas
-                        if normalized in [u.lower() for u in unwanted_values] or any(
-                            u.lower() in normalized for u in [
-                                "no mencionado", "no especificado", "ninguno", "no disponible"
-                            ]
-                        ):
-                            continue
-
-                        # Solo guardar valores que pasan todas las validaciones
-                        filtered_json[field] = value
-                    elif value is not None and value != False:
-                        # Para valores booleanos, sólo incluir True (False a menudo es valor por defecto)
-                        filtered_json[field] = value
-
-                # Registrar solo los campos con valores válidos
-                for field, value in filtered_json.items():
-                    all_extracted_data[field] = value
-                    if field not in auto_completed_fields:
-                        auto_completed_fields.append(field)
-
-            except json.JSONDecodeError as json_err:
-                # Código de manejo de errores existente sin cambios...
-                print(f"Error parsing JSON: {json_err}")
-                print(f"Raw response: {extracted_data}")
-
-                # Plan B: Crear un JSON con los campos que podamos extraer
-                try:
-                    # Regex para extraer pares clave-valor
-                    import re
-                    pairs = re.findall(
-                        r'"([^"]+)"\s*:\s*("[^"]*"|null|\d+|true|false)', extracted_data)
-
-                    if pairs:
-                        fallback_json = "{"
-                        for i, (key, value) in enumerate(pairs):
-                            fallback_json += f'"{key}":{value}'
-                            if i < len(pairs) - 1:
-                                fallback_json += ","
-                        fallback_json += "}"
-
-                        extracted_json = json.loads(fallback_json)
-
-                        # Registrar solo los campos autocompletados
-                        for field, value in extracted_json.items():
-                            if value is not None and value != "" and value != "null":
-                                all_extracted_data[field] = value
-                                if field not in auto_completed_fields:
-                                    auto_completed_fields.append(field)
-                except:
-                    pass
-
-                print(
-                    f"Error parsing response from AI, raw response: {extracted_data}")
-                continue
+def merge_batch_results(results, batches):
+    """Combina los resultados en orden de lote para que la salida sea determinista."""
+    # Almacenar resultados
+    all_extracted_data = {}
+    auto_completed_fields = []  # Lista para seguir qué campos fueron autocompletados
 
-        except Exception as e:
-            print(f"Error al procesar lote {i}-{i+batch_size}: {e}")
+    for result in sorted(results, key=lambda r: r.index):
+        if not result.ok:
+            logger.error(
+                "Error al procesar el lote %d (%d campos): %s",
+                result.index, len(batches[result.index]), result.error)
             # Continuar con el siguiente lote
+            continue
+
+        # Registrar solo los campos con valores válidos
+        for field, value in result.value.items():
+            all_extracted_data[field] = value
+            if field not in auto_completed_fields:
+                auto_completed_fields.append(field)
+
+    return all_extracted_data, auto_completed_fields
+
+
+def run_extraction(plan, before_batch=None):
+    """Ejecuta el plan y devuelve el cuerpo de la respuesta de /extract_project_data.
+
+    before_batch se llama antes de cada lote; los trabajos en segundo plano lo
+    usan para dejar de llamar al modelo en cuanto se cancelan.
+    """
+    worker = extraction_worker(plan)
+    if before_batch is not None:
+        process_batch = worker
+
+        def worker(batch):
+            before_batch()
+            return process_batch(batch)
+
+    # Enviar los lotes en paralelo; los resultados vuelven en el orden de los lotes
+    results = dispatch_ordered(worker, plan["batches"], EXTRACTION_MAX_WORKERS)
+    if before_batch is not None:
+        # Un trabajo cancelado a medias no debe guardar resultados parciales en la sesión
+        before_batch()
+
+    all_extracted_data, auto_completed_fields = merge_batch_results(
+        results, plan["batches"])
+
+    if plan["session_id"]:
+        # En modo sesión solo se devuelven los valores nuevos o cambiados en este turno
+        delta = merge_session_extraction(
+            plan["session_id"], plan["turn"], all_extracted_data, plan["mode"])
+        return {
+            "data": delta,
+            "autoCompletedFields": list(delta),
+            "turn": plan["turn"],
+            "answeredFields": plan["answered"],
+        }
 
     # Devolver todos los datos extraídos y qué campos fueron autocompletados
-    return jsonify({
+    return {
         "data": all_extracted_data,
         "autoCompletedFields": auto_completed_fields
-    })
+    }
+
+
+@app.route("/extract_project_data", methods=["POST"])
+def extract_project_data():
+    """Extrae los campos del mensaje.
+
+    Con ?async=1 (o "async": true) la extracción se encola como trabajo en
+    segundo plano y se responde al momento con su identificador.
+    """
+    data = request.json
+    if wants_async(data):
+        return submit_job_response(
+            "extraction", data, reuse_finished=not data.get("session_id"))
+
+    error, plan = prepare_extraction(data)
+    if error:
+        return error
+
+    return jsonify(run_extraction(plan))
+
+
+@app.route("/extract_project_data/stream", methods=["POST"])
+def extract_project_data_stream():
+    """Variante en streaming: emite los campos de cada lote en cuanto se procesa.
+
+    Por defecto responde en NDJSON (un objeto JSON por línea); si el cliente
+    envía 'Accept: text/event-stream' se usa Server-Sent Events.
+    """
+    error, plan = prepare_extraction(request.json)
+    if error:
+        return error
+
+    use_sse = "text/event-stream" in request.headers.get("Accept", "")
+
+    def frame(payload):
+        line = json.dumps(payload, ensure_ascii=False)
+        if use_sse:
+            return f"event: {payload['type']}\ndata: {line}\n\n"
+        return line + "\n"
+
+    def generate():
+        started = time.perf_counter()
+        results = []
+        deltas = {}
+        for result in dispatch_as_completed(
+                extraction_worker(plan), plan["batches"], EXTRACTION_MAX_WORKERS):
+            results.append(result)
+            payload = {
+                "type": "batch",
+                "index": result.index,
+                "elapsed_ms": round(result.elapsed * 1000, 1),
+            }
+            if result.ok and plan["session_id"]:
+                # Cada lote se guarda en la sesión al terminar; solo viajan los cambios
+                payload["data"] = deltas[result.index] = merge_session_extraction(
+                    plan["session_id"], plan["turn"], result.value, plan["mode"])
+            elif result.ok:
+                payload["data"] = result.value
+            else:
+                payload["error"] = str(result.error)
+            yield frame(payload)
+
+        all_extracted_data, auto_completed_fields = merge_batch_results(
+            results, plan["batches"])
+        if plan["session_id"]:
+            all_extracted_data = {}
+            for index in sorted(deltas):
+                all_extracted_data.update(deltas[index])
+            auto_completed_fields = list(all_extracted_data)
+
+        summary = {
+            "type": "summary",
+            "data": all_extracted_data,
+            "autoCompletedFields": auto_completed_fields,
+            "batches": [
+                {
+                    "index": r.index,
+                    "fields": len(plan["batches"][r.index]),
+                    "max_tokens": plan["batches"][r.index].max_tokens,
+                    "ok": r.ok,
+                    "elapsed_ms": round(r.elapsed * 1000, 1),
+                }
+                for r in sorted(results, key=lambda r: r.index)
+            ],
+            "skippedFields": plan["skipped"],
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        if plan["session_id"]:
+            summary["turn"] = plan["turn"]
+            summary["answeredFields"] = plan["answered"]
+        yield frame(summary)
+
+    mimetype = "text/event-stream" if use_sse else "application/x-ndjson"
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/extraction_cache/stats", methods=["GET"])
+def extraction_cache_stats():
+    return jsonify(extraction_cache.stats())
+
+
+@app.route("/extraction_planner/stats", methods=["GET"])
+def extraction_planner_stats():
+    return jsonify(batch_planner.stats())
+
+
+@app.route("/admin/extraction_cache/clear", methods=["POST"])
+def extraction_cache_clear():
+    if not admin_authorized():
+        return jsonify({"error": "No autorizado"}), 403
+    extraction_cache.clear()
+    return jsonify({"status": "success", "message": "Caché de extracción vaciada"})
 
 # Add this new endpoint after your existing endpoints
 
 
+def segment_audio(data):
+    """Convierte el audio a WAV y lo divide en segmentos solapados.
+
+    Devuelve (error, segmentos); error es (mensaje, status HTTP) o None.
+    """
+    try:
+        wav = to_wav(data)
+        if wav_duration(wav) > TRANSCRIBE_CHUNKED_MAX_SECONDS:
+            return (f"Audio longer than {TRANSCRIBE_CHUNKED_MAX_SECONDS} seconds", 413), None
+        return None, split_wav(wav, TRANSCRIBE_SEGMENT_SECONDS, TRANSCRIBE_SEGMENT_OVERLAP)
+    except (AudioConversionError, wave.Error, EOFError) as e:
+        return (f"Error processing audio: {str(e)}", 400), None
+
+
+def transcribe_segment(segment):
+    return transcriber.transcribe(
+        openai_client, io.BytesIO(segment.data),
+        f"segmento-{segment.index}.wav", "audio/wav")
+
+
+def transcribe_all_segments(segments, before_segment=None):
+    """Transcribe los segmentos en paralelo y une el texto.
+
+    Devuelve (error, cuerpo de la respuesta); error es (mensaje, status HTTP)
+    si no se ha podido transcribir ningún segmento.
+    """
+    def worker(segment):
+        if before_segment is not None:
+            before_segment()
+        return transcribe_segment(segment)
+
+    results = dispatch_ordered(worker, segments, TRANSCRIBE_SEGMENT_WORKERS)
+    failed = [r.index for r in results if not r.ok]
+    if len(failed) == len(results):
+        logger.error("Error transcribing audio: %s", results[0].error)
+        return (f"Error processing audio: {results[0].error}", 500), None
+    return None, {
+        "success": True,
+        "text": stitch_transcripts([r.value for r in results if r.ok]),
+        "segments": len(segments),
+        "failedSegments": failed,
+    }
+
+
+def transcribe_segments(audio_file, stream_results):
+    """Transcripción por segmentos solapados para notas de voz largas.
+
+    Divide el audio, transcribe los segmentos en paralelo y une el texto
+    eliminando lo repetido en los solapamientos. Con stream_results emite
+    NDJSON con cada segmento y el texto parcial acumulado.
+    """
+    error, segments = segment_audio(audio_file.stream.read())
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    if not stream_results:
+        error, body = transcribe_all_segments(segments)
+        if error:
+            return jsonify({"error": error[0]}), error[1]
+        return jsonify(body)
+
+    def generate():
+        texts = {}
+        failed = []
+        emitted_prefix = 0
+        for result in dispatch_as_completed(
+                transcribe_segment, segments, TRANSCRIBE_SEGMENT_WORKERS):
+            segment = segments[result.index]
+            frame = {
+                "type": "segment",
+                "index": segment.index,
+                "start": segment.start,
+                "end": segment.end,
+            }
+            if result.ok:
+                texts[result.index] = result.value
+                frame["text"] = result.value
+            else:
+                failed.append(result.index)
+                texts[result.index] = ""
+                frame["error"] = str(result.error)
+            yield json.dumps(frame, ensure_ascii=False) + "\n"
+
+            # Texto parcial: solo cuando se completa un prefijo continuo de segmentos
+            prefix = emitted_prefix
+            while prefix in texts:
+                prefix += 1
+            if prefix > emitted_prefix:
+                emitted_prefix = prefix
+                partial = stitch_transcripts([texts[i] for i in range(prefix)])
+                yield json.dumps({"type": "partial", "text": partial}, ensure_ascii=False) + "\n"
+
+        yield json.dumps({
+            "type": "final",
+            "success": len(failed) < len(segments),
+            "text": stitch_transcripts([texts[i] for i in range(len(segments))]),
+            "segments": len(segments),
+            "failedSegments": sorted(failed),
+        }, ensure_ascii=False) + "\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/transcribe_audio", methods=["POST"])
 def transcribe_audio():
-    """Endpoint to transcribe audio using OpenAI's Whisper API"""
-    if 'audio' not in request.files:
-        return jsonify({"error": "No audio file provided"}), 400
+    """Endpoint to transcribe audio using OpenAI's Whisper API
+
+    Con ?mode=chunked el audio se transcribe por segmentos en paralelo, y con
+    ?mode=chunked&stream=1 los textos parciales se devuelven en NDJSON.
+    """
+    chunked = request.args.get("mode") == "chunked"
+    max_bytes = TRANSCRIBE_CHUNKED_MAX_BYTES if chunked else TRANSCRIBE_MAX_BYTES
+    max_seconds = TRANSCRIBE_CHUNKED_MAX_SECONDS if chunked else TRANSCRIBE_MAX_SECONDS
+
+    # Rechazar subidas demasiado grandes antes de leer el cuerpo
+    request.max_content_length = max_bytes
+
+    try:
+        if 'audio' not in request.files:
+            return jsonify({"error": "No audio file provided"}), 400
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"Audio file exceeds {max_bytes} bytes"}), 413
 
     audio_file = request.files['audio']
 
     if audio_file.filename == '':
         return jsonify({"error": "No audio file selected"}), 400
 
+    # Duración declarada por el cliente (segundos), si la envía
+    try:
+        duration = float(request.form.get("duration", 0))
+    except ValueError:
+        return jsonify({"error": "Invalid 'duration' value"}), 400
+    if max_seconds and duration > max_seconds:
+        return jsonify({"error": f"Audio longer than {max_seconds} seconds"}), 413
+
+    # La duración declarada es opcional: sin chunked (que ya mide al segmentar)
+    # se comprueba también la de la cabecera, sin decodificar el audio
+    if not chunked and max_seconds and TRANSCRIBE_MEASURE_DURATION:
+        measured = probe_duration(audio_file.stream)
+        if measured is not None and measured > max_seconds:
+            return jsonify({"error": f"Audio longer than {max_seconds} seconds"}), 413
+
     if not openai_client:
         return jsonify({"error": "OpenAI client not initialized"}), 500
 
-    try:
-        # Save the file temporarily
-        temp_audio_path = "temp_audio.webm"
-        audio_file.save(temp_audio_path)
-
-        # Open the file for the OpenAI API
-        with open(temp_audio_path, "rb") as audio_data:
-            # Call OpenAI's transcription API
-            transcript = openai_client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_data,
-                language="es"  # Spanish language for better accuracy
-            )
+    if wants_async():
+        # El audio se guarda con el trabajo: la petición puede terminar ya
+        data = audio_file.stream.read()
+        audio_file.close()
+        return submit_job_response("transcription", {
+            "mode": "chunked" if chunked else "single",
+            "mimetype": audio_file.mimetype,
+            # Whisper deduce el formato por la extensión; el nombre no cuenta para deduplicar
+            "extension": os.path.splitext(audio_file.filename)[1].lower(),
+        }, data=data)
 
-        # Clean up the temporary file
-        os.remove(temp_audio_path)
+    if chunked:
+        return transcribe_segments(audio_file, request.args.get("stream") == "1")
+
+    try:
+        # El audio se envía desde memoria (o desde un temporal único si es grande)
+        text = transcriber.transcribe(
+            openai_client, audio_file.stream, audio_file.filename, audio_file.mimetype)
 
         # Return the transcription
         return jsonify({
             "success": True,
-            "text": transcript.text
+            "text": text
         })
 
+    except TranscriptionBusy as e:
+        return jsonify({"error": str(e)}), 503
+
     except Exception as e:
-        print(f"Error transcribing audio: {str(e)}")
+        logger.error("Error transcribing audio: %s", e)
         return jsonify({"error": f"Error processing audio: {str(e)}"}), 500
 
+    finally:
+        audio_file.close()
+
+
+# Trabajos en segundo plano (?async=1) para extracciones y transcripciones largas
+JOBS_MAX_WAIT = float(os.getenv("JOBS_MAX_WAIT", "60"))
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Abre la cola y arranca sus hilos la primera vez que se usa el modo asíncrono."""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            queue = JobQueue(
+                os.getenv("JOBS_DB_PATH", "jobs.db"),
+                workers=int(os.getenv("JOBS_WORKERS", "2")),
+                # Segundos que se conservan los resultados y máximo de trabajos terminados
+                retention=int(os.getenv("JOBS_RETENTION", "3600")),
+                max_retained=int(os.getenv("JOBS_MAX_RETAINED", "1000")),
+            )
+            queue.register("extraction", run_extraction_job)
+            queue.register("transcription", run_transcription_job)
+            queue.start()
+            _job_queue = queue
+        return _job_queue
+
+
+def wants_async(data=None):
+    if request.args.get("async") == "1":
+        return True
+    return isinstance(data, dict) and data.get("async") is True
+
+
+def submit_job_response(kind, payload, data=None, reuse_finished=True):
+    """Encola el trabajo y responde 202 con su identificador."""
+    if isinstance(payload, dict):
+        payload = {key: value for key, value in payload.items() if key != "async"}
+    job, created = get_job_queue().submit(kind, payload, data, reuse_finished=reuse_finished)
+    return jsonify({
+        "job_id": job["id"],
+        "status": job["status"],
+        "deduplicated": not created,
+    }), 202, {"Location": f"/jobs/{job['id']}"}
+
+
+def run_extraction_job(job):
+    with app.app_context():
+        error, plan = prepare_extraction(job.payload)
+    if error:
+        raise JobError(error[0].get_json()["error"])
+    return run_extraction(plan, before_batch=job.check_cancelled)
+
+
+def run_transcription_job(job):
+    if job.payload["mode"] == "chunked":
+        error, segments = segment_audio(job.data)
+        if error:
+            raise JobError(error[0])
+        error, body = transcribe_all_segments(segments, before_segment=job.check_cancelled)
+        if error:
+            raise JobError(error[0])
+        return body
+
+    try:
+        text = transcriber.transcribe(
+            openai_client, io.BytesIO(job.data),
+            f"audio{job.payload['extension']}", job.payload["mimetype"])
+    except TranscriptionBusy as e:
+        raise JobError(str(e)) from e
+    return {"success": True, "text": text}
+
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Estado y resultado de un trabajo; con ?wait=N espera hasta N segundos a que termine."""
+    try:
+        wait = min(float(request.args.get("wait", 0)), JOBS_MAX_WAIT)
+    except ValueError:
+        return jsonify({"error": "Valor de 'wait' no válido"}), 400
+
+    job = get_job_queue().wait(job_id, wait) if wait > 0 else get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "El trabajo no existe o ha caducado"}), 404
+    return jsonify(job)
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """Server-Sent Events con cada cambio de estado del trabajo hasta que termina."""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "El trabajo no existe o ha caducado"}), 404
+
+    def generate():
+        current = job
+        last_status = None
+        deadline = time.monotonic() + JOBS_MAX_WAIT * 10
+        while current is not None:
+            if current["status"] != last_status:
+                last_status = current["status"]
+                yield f"event: {last_status}\ndata: {json.dumps(current, ensure_ascii=False)}\n\n"
+            if current["status"] in FINISHED or time.monotonic() > deadline:
+                return
+            current = get_job_queue().wait(job_id, min(15.0, JOBS_MAX_WAIT))
+            if current is not None and current["status"] == last_status:
+                # Comentario SSE para que los proxies no cierren la conexión inactiva
+                yield ": keep-alive\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    job = get_job_queue().cancel(job_id)
+    if job is None:
+        return jsonify({"error": "El trabajo no existe o ha caducado"}), 404
+    return jsonify(job)
+
+
+@app.route("/jobs/stats", methods=["GET"])
+def job_queue_stats():
+    return jsonify(get_job_queue().stats())
+
+
+# Límites de validación de respuestas y del cuerpo de /answers (ya descomprimido)
+MAX_ANSWER_KEY_LENGTH = 256
+MAX_ANSWER_LENGTH = int(os.getenv("MAX_ANSWER_LENGTH", "10000"))
+MAX_ANSWERS_BODY_BYTES = int(os.getenv("MAX_ANSWERS_BODY_BYTES", str(8 * 1024 * 1024)))
+
+SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+def validate_answer(key, value):
+    """Devuelve un mensaje de error para la respuesta, o None si es válida."""
+    if not isinstance(key, str) or not key.strip():
+        return "La clave debe ser un texto no vacío"
+    if len(key) > MAX_ANSWER_KEY_LENGTH:
+        return f"La clave supera {MAX_ANSWER_KEY_LENGTH} caracteres"
+    values = value if isinstance(value, list) else [value]
+    for item in values:
+        if not isinstance(item, SCALAR_TYPES):
+            return "El valor debe ser texto, número, booleano o una lista de ellos"
+        if isinstance(item, str) and len(item) > MAX_ANSWER_LENGTH:
+            return f"El valor supera {MAX_ANSWER_LENGTH} caracteres"
+    return None
+
+
+def update_session_answers(session_id, answers, unnamed_values=(), create=False, reset=False):
+    """Núcleo común de /start, /answer y /answers.
+
+    Valida todas las respuestas y, solo si todas son válidas, las aplica de una
+    vez sobre la sesión. Devuelve (sesión, resultados por clave); la sesión es
+    None si alguna respuesta no es válida o si la sesión no existe y no se crea.
+    """
+    results = {}
+    for key, value in answers.items():
+        error = validate_answer(key, value)
+        results[key] = {"valid": True} if error is None else {"valid": False, "error": error}
+    for value in unnamed_values:
+        error = validate_answer("answer", value)
+        if error is not None:
+            results["answer"] = {"valid": False, "error": error}
+
+    if any(not result["valid"] for result in results.values()):
+        return None, results
+
+    def apply_answers(session):
+        if reset:
+            session.update(new_session())
+        session["answers"].update(answers)
+        # Los valores sin clave se guardan con una clave genérica
+        for value in unnamed_values:
+            answer_id = f"answer_{len(session['answers']) + 1}"
+            session["answers"][answer_id] = value
+
+    with span("session_store.update"):
+        session = session_store.update(session_id, apply_answers, create=create or reset)
+    return session, results
+
+
+def read_json_body(max_bytes):
+    """Lee el cuerpo JSON de la petición, descomprimiéndolo si viene en gzip.
+
+    Lanza RequestEntityTooLarge si el cuerpo recibido supera max_bytes.
+    """
+    # Limitar también el cuerpo tal como llega, antes de leerlo en memoria
+    request.max_content_length = max_bytes
+    raw = request.get_data(cache=False)
+    encoding = request.headers.get("Content-Encoding", "").lower()
+    if encoding in ("gzip", "deflate"):
+        # wbits=47 detecta automáticamente cabeceras gzip y zlib
+        decompressor = zlib.decompressobj(wbits=47)
+        raw = decompressor.decompress(raw, max_bytes + 1)
+        if decompressor.unconsumed_tail:
+            raise ValueError("El cuerpo descomprimido es demasiado grande")
+    elif encoding not in ("", "identity"):
+        raise ValueError(f"Content-Encoding no soportado: {encoding}")
+    if len(raw) > max_bytes:
+        raise ValueError("El cuerpo de la petición es demasiado grande")
+    data = json.loads(raw)
+    if not isinstance(data, dict):
+        raise ValueError("El cuerpo debe ser un objeto JSON")
+    return data
+
 
 @app.route("/start", methods=["POST"])
 def start_session():
@@ -340,12 +1371,14 @@ def start_session():
     if not session_id:
         return jsonify({"error": "Falta el campo 'session_id'"}), 400
 
+    if not isinstance(existing_answers, dict):
+        return jsonify({"error": "El campo 'existing_answers' debe ser un objeto"}), 400
+
     # Guardar la sesión con las respuestas iniciales
-    session_store[session_id] = {
-        "answers": existing_answers,
-        # Timestamp para seguimiento
-        "started_at": str(os.path.getmtime(__file__))
-    }
+    session, results = update_session_answers(
+        session_id, existing_answers, reset=True)
+    if session is None:
+        return jsonify({"error": "Respuestas no válidas", "results": results}), 400
 
     return jsonify({
         "status": "success",
@@ -366,19 +1399,19 @@ def save_answer():
     if not answer:
         return jsonify({"error": "Falta el campo 'answer'"}), 400
 
-    # Verificar si la sesión existe
-    if session_id not in session_store:
-        return jsonify({"error": "La sesión no existe o ha expirado"}), 404
-
-    # Almacenar la respuesta (asumiendo que answer tiene una estructura con ID de pregunta)
-    # Si answer es un diccionario, agregar cada clave-valor
+    # Si answer es un diccionario, agregar cada clave-valor; si no, clave genérica
     if isinstance(answer, dict):
-        for key, value in answer.items():
-            session_store[session_id]["answers"][key] = value
+        session, results = update_session_answers(session_id, answer)
     else:
-        # Si es un solo valor, guardarlo con una clave genérica
-        answer_id = f"answer_{len(session_store[session_id]['answers']) + 1}"
-        session_store[session_id]["answers"][answer_id] = answer
+        session, results = update_session_answers(
+            session_id, {}, unnamed_values=[answer])
+
+    if session is None and any(not r["valid"] for r in results.values()):
+        return jsonify({"error": "Respuesta no válida", "results": results}), 400
+
+    # Verificar si la sesión existe
+    if session is None:
+        return jsonify({"error": "La sesión no existe o ha expirado"}), 404
 
     return jsonify({
         "status": "success",
@@ -386,115 +1419,141 @@ def save_answer():
     })
 
 
+@app.route("/answers", methods=["POST"])
+def save_answers():
+    """Crea o actualiza una sesión aplicando un mapa completo de respuestas.
+
+    Sustituye a /start más una llamada a /answer por campo. Acepta cuerpos
+    comprimidos con 'Content-Encoding: gzip'. Si alguna respuesta no es válida
+    no se aplica ninguna y se devuelve el resultado de cada clave.
+    """
+    try:
+        data = read_json_body(MAX_ANSWERS_BODY_BYTES)
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"El cuerpo supera {MAX_ANSWERS_BODY_BYTES} bytes"}), 413
+    except (ValueError, zlib.error) as e:
+        return jsonify({"error": f"Cuerpo no válido: {e}"}), 400
+
+    session_id = data.get("session_id")
+    answers = data.get("answers", {})
+
+    if not session_id:
+        return jsonify({"error": "Falta el campo 'session_id'"}), 400
+
+    if not isinstance(answers, dict):
+        return jsonify({"error": "El campo 'answers' debe ser un objeto"}), 400
+
+    with span("session_store.exists"):
+        created = not session_store.exists(session_id)
+    session, results = update_session_answers(
+        session_id, answers, create=True, reset=bool(data.get("reset")))
+
+    if session is None:
+        return jsonify({
+            "status": "error",
+            "error": "Respuestas no válidas",
+            "session_id": session_id,
+            "results": results,
+        }), 400
+
+    return jsonify({
+        "status": "success",
+        "message": "Respuestas guardadas correctamente",
+        "session_id": session_id,
+        "created": created,
+        "applied": len(answers),
+        "results": results,
+    })
+
+
+@app.route("/sessions/stats", methods=["GET"])
+def session_store_stats():
+    return jsonify(session_store.stats())
+
+
+# Cliente compartido (pool keep-alive) para la API externa del ERP
+erp_client = ERPClient(
+    os.getenv("ERP_BASE_URL", "https://erp.wskserver.com:56544"),
+    pool_connections=int(os.getenv("ERP_POOL_CONNECTIONS", "4")),
+    pool_maxsize=int(os.getenv("ERP_POOL_MAXSIZE", "16")),
+    connect_timeout=float(os.getenv("ERP_CONNECT_TIMEOUT", "5")),
+    read_timeout=float(os.getenv("ERP_READ_TIMEOUT", "30")),
+    # Segundos que se reutiliza el catálogo de preguntas; 0 lo desactiva
+    cache_ttl=int(os.getenv("ERP_CONSULT_CACHE_TTL", "60")),
+)
+
+
 # Proxy para la API externa de preguntas
 @app.route('/api/HTDV2/consult', methods=['POST'])
 def proxy_external_api():
     try:
-        print(">>> Recibida petición al proxy de la API externa")
-        print(f">>> Headers: {request.headers}")
-        print(f">>> Body: {request.json}")
-
         # Obtener el token de la cabecera
         auth_header = request.headers.get('Authorization')
         if not auth_header:
             return jsonify({"error": "Falta el token de autorización"}), 401
 
-        # Preparar la solicitud para reenviar a la API externa
-        headers = {
-            'Authorization': auth_header,
-            'Content-Type': 'application/json'
-        }
-
-        # URL real de la API externa
-        external_api_url = 'https://erp.wskserver.com:56544/api/HTDV2/consult'
+        # Reenviar la solicitud a la API externa (o servirla desde la caché)
+        status, catalogue, cached = erp_client.consult(auth_header, request.json)
 
-        # Reenviar la solicitud a la API externa
-        response = requests.post(
-            external_api_url,
-            headers=headers,
-            json=request.json,
-            verify=True  # Si la API externa usa HTTPS con un certificado válido
-        )
-
-        # Antes de devolver la respuesta
-        print(f">>> Respuesta de la API externa: {response.status_code}")
-        # Primeros 200 caracteres
-        print(f">>> Contenido: {response.text[:200]}...")
+        # Aprovechar el catálogo para precalentar el almacén de preguntas
+        if status == 200 and not cached and QUESTION_STORE_AUTOWARM:
+            warm_question_store(catalogue_descriptions(catalogue))
 
-        return response.json(), response.status_code
+        return catalogue, status
     except Exception as e:
-        print(f">>> ERROR en proxy_external_api: {e}")
+        logger.error("Error en proxy_external_api: %s", e)
         return jsonify({"error": f"Error: {str(e)}"}), 500
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Métricas del proceso en formato de texto de Prometheus."""
+    if not admin_authorized():
+        return jsonify({"error": "No autorizado"}), 403
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+# Frontend compilado, indexado una vez al arrancar (y al llamar a /admin/static/reload)
+static_assets = StaticAssets(
+    os.getenv("STATIC_ROOT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")))
+static_assets.reload()
+
+
+@app.route("/admin/static/reload", methods=["POST"])
+def reload_static_assets():
+    """Vuelve a indexar el frontend tras desplegar una nueva compilación."""
+    if not admin_authorized():
+        return jsonify({"error": "No autorizado"}), 403
+    files = static_assets.reload()
+    return jsonify({"status": "success", "files": files, **static_assets.stats()})
+
+
 # Ruta para servir el frontend
 @app.route("/", defaults={"path": ""})
 @app.route("/<path:path>")
 def serve_frontend(path):
-    if path != "" and os.path.exists(os.path.join(app.static_folder, path)):
-        return send_from_directory(app.static_folder, path)
-    else:
-        return send_from_directory(app.static_folder, "index.html")
+    response = static_assets.response(request, path)
+    if response is None:
+        return jsonify({"error": "Archivo no encontrado"}), 404
+    return response
 
 
 if __name__ == "__main__":
-    import ssl
-    import os
-    import tempfile
-    from cryptography.hazmat.primitives.serialization.pkcs12 import load_key_and_certificates
-    from cryptography.hazmat.primitives.serialization import Encoding, PrivateFormat, NoEncryption
-
-    # Ajusta esta ruta a donde esté tu .pfx en Linux
-    pfx_path = "./novagric-2026.pfx" 
-    # "/home/practicas-ti/ChatBot/backend/novagric-2026.pfx"
-    # Reemplaza con la ruta real en tu sistema Linux
-    pfx_password = "2j70m86a9"
-
-    def load_pfx_to_temp(pfx_path, pfx_password):
-        # 1. Leer bytes del PFX
-        with open(pfx_path, "rb") as f:
-            pfx_data = f.read()
-
-        # 2. Extraer clave, certificado y CA intermedias
-        private_key, cert, additional_certs = load_key_and_certificates(
-            pfx_data,
-            pfx_password.encode("utf-8"),
-            None
-        )
+    # Servidor de desarrollo de Flask; en producción usar server.py (gevent)
+    from certificates import build_ssl_context
 
-        # 3. Volcar todo en un único PEM temporal
-        pem_file = tempfile.NamedTemporaryFile(delete=False, suffix=".pem")
-        with open(pem_file.name, "wb") as out:
-            # Clave privada en PKCS8
-            out.write(private_key.private_bytes(
-                encoding=Encoding.PEM,
-                format=PrivateFormat.PKCS8,
-                encryption_algorithm=NoEncryption()
-            ))
-            # Certificado principal
-            out.write(cert.public_bytes(Encoding.PEM))
-            # Cualquier CA intermedia
-            if additional_certs:
-                for ca in additional_certs:
-                    out.write(ca.public_bytes(Encoding.PEM))
-
-        return pem_file.name
+    debug = os.getenv("FLASK_DEBUG", "1") == "1"
 
     try:
-        # Convertimos el PFX → un único PEM que contiene clave+certificados
-        pem_path = load_pfx_to_temp(pfx_path, pfx_password)
-
-        # Creamos el contexto SSL y cargamos el PEM como certfile y keyfile
-        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-        context.load_cert_chain(certfile=pem_path, keyfile=pem_path)
+        context, pem_path = build_ssl_context()
 
         print("🚀 Servidor seguro en https://0.0.0.0:5002 usando tu .pfx")
-        app.run(host="0.0.0.0", port=5002, debug=True, ssl_context=context)
+        app.run(host="0.0.0.0", port=5002, debug=debug, ssl_context=context)
 
     except Exception as e:
         print(f"❌ Error al cargar PFX: {e}")
         print("🟡 Iniciando sin SSL…")
-        app.run(host="0.0.0.0", port=5002, debug=True)
+        app.run(host="0.0.0.0", port=5002, debug=debug)
 
     finally:
         # Limpiar el archivo PEM temporal
@@ -0,0 +1,177 @@
+import io
+import re
+import shutil
+import subprocess
+import wave
+
+
+class AudioConversionError(Exception):
+    """El audio no es WAV y no hay ffmpeg para convertirlo."""
+
+
+class Segment:
+    """Fragmento de audio entre start y end (segundos) como WAV independiente."""
+
+    __slots__ = ("index", "start", "end", "data")
+
+    def __init__(self, index, start, end, data):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.data = data
+
+
+def plan_segments(duration, segment_seconds, overlap_seconds):
+    """Devuelve los intervalos (inicio, fin) que cubren el audio con solapamiento."""
+    if duration <= 0:
+        return []
+    if overlap_seconds >= segment_seconds:
+        raise ValueError("El solapamiento debe ser menor que la duración del segmento")
+
+    step = segment_seconds - overlap_seconds
+    intervals = []
+    start = 0.0
+    while True:
+        end = min(start + segment_seconds, duration)
+        intervals.append((round(start, 3), round(end, 3)))
+        if end >= duration:
+            return intervals
+        start += step
+
+
+def to_wav(data, ffmpeg=None):
+    """Devuelve el audio como WAV PCM; convierte con ffmpeg si no lo es ya."""
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        return data
+
+    ffmpeg = ffmpeg or shutil.which("ffmpeg")
+    if not ffmpeg:
+        raise AudioConversionError(
+            "La transcripción por segmentos necesita audio WAV o ffmpeg instalado")
+
+    # Mono a 16 kHz: suficiente para voz y mucho más ligero que el original
+    result = subprocess.run(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+         "-ac", "1", "-ar", "16000", "-f", "wav", "pipe:1"],
+        input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False,
+    )
+    if result.returncode != 0:
+        raise AudioConversionError(
+            f"ffmpeg no pudo convertir el audio: {result.stderr.decode(errors='ignore')[:200]}")
+    return result.stdout
+
+
+def wav_duration(data):
+    with wave.open(io.BytesIO(data), "rb") as reader:
+        return reader.getnframes() / float(reader.getframerate())
+
+
+def probe_duration(stream, ffprobe=None, chunk_size=64 * 1024):
+    """Duración en segundos leyendo solo la cabecera, sin decodificar el audio.
+
+    WAV se mide con su cabecera; el resto con los metadatos del contenedor
+    vía ffprobe, si está instalado. Devuelve None si no se puede saber (por
+    ejemplo, los webm de MediaRecorder no guardan la duración). El stream se
+    lee por trozos, sin cargarlo entero en memoria, y queda al inicio.
+    """
+    stream.seek(0)
+    head = stream.read(12)
+    stream.seek(0)
+    try:
+        if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+            try:
+                with wave.open(stream, "rb") as reader:
+                    return reader.getnframes() / float(reader.getframerate())
+            except (wave.Error, EOFError):
+                return None
+
+        ffprobe = ffprobe or shutil.which("ffprobe")
+        if not ffprobe:
+            return None
+        process = subprocess.Popen(
+            [ffprobe, "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", "pipe:0"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        )
+        try:
+            # ffprobe deja de leer en cuanto tiene los metadatos y cierra la tubería
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+        output = process.stdout.read().decode(errors="ignore").strip()
+        process.wait()
+        try:
+            return float(output)
+        except ValueError:
+            return None
+    finally:
+        stream.seek(0)
+
+
+def split_wav(data, segment_seconds, overlap_seconds):
+    """Divide un WAV en segmentos solapados, cada uno un WAV válido por sí mismo."""
+    with wave.open(io.BytesIO(data), "rb") as reader:
+        params = reader.getparams()
+        rate = reader.getframerate()
+        duration = reader.getnframes() / float(rate)
+
+        segments = []
+        for index, (start, end) in enumerate(
+                plan_segments(duration, segment_seconds, overlap_seconds)):
+            reader.setpos(int(start * rate))
+            frames = reader.readframes(int(end * rate) - int(start * rate))
+
+            out = io.BytesIO()
+            with wave.open(out, "wb") as writer:
+                writer.setparams(params)
+                writer.writeframes(frames)
+            segments.append(Segment(index, start, end, out.getvalue()))
+        return segments
+
+
+def _normalize_word(word):
+    return re.sub(r"[^\w]", "", word.lower())
+
+
+def find_overlap(previous_words, next_words, max_overlap_words=30, min_ratio=0.8):
+    """Longitud del solapamiento entre el final de un texto y el inicio del siguiente.
+
+    Las palabras cortadas en los bordes de un segmento pueden transcribirse
+    distinto, así que se acepta el solapamiento más largo en el que coincide al
+    menos min_ratio de las palabras (con un mínimo de dos coincidencias).
+    """
+    tail = [_normalize_word(w) for w in previous_words[-max_overlap_words:]]
+    head = [_normalize_word(w) for w in next_words[:max_overlap_words]]
+
+    for k in range(min(len(tail), len(head)), 0, -1):
+        matches = sum(1 for a, b in zip(tail[-k:], head[:k]) if a == b)
+        if k == 1:
+            return 1 if matches == 1 else 0
+        if matches >= 2 and matches >= min_ratio * k:
+            return k
+    return 0
+
+
+def stitch_transcripts(texts, max_overlap_words=30):
+    """Une las transcripciones de segmentos consecutivos sin repetir el solapamiento.
+
+    Dentro de la zona solapada se toma la primera mitad del segmento anterior
+    y la segunda mitad del siguiente: las palabras más alejadas del corte son
+    las que mejor se han transcrito.
+    """
+    words = []
+    for text in texts:
+        new_words = (text or "").split()
+        if not words:
+            words = new_words
+            continue
+        overlap = find_overlap(words, new_words, max_overlap_words)
+        keep_previous = len(words) - overlap + overlap // 2
+        words = words[:keep_previous] + new_words[overlap // 2:]
+    return " ".join(words)
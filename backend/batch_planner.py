@@ -0,0 +1,250 @@
+import math
+import threading
+import time
+from collections import deque
+
+from llm import estimate_tokens
+from metrics import REGISTRY
+from structured_extraction import field_options
+
+
+planned_batches = REGISTRY.counter(
+    "chatbot_extraction_batches_total",
+    "Lotes de extracción ejecutados, por forma de lote y resultado",
+    ("shape", "outcome"),
+)
+
+# Formas de lote: clases por número de campos, para agrupar las estadísticas
+SHAPE_LIMITS = (4, 8, 16, 32, 64, 128)
+
+
+def batch_shape(field_count):
+    """Clase del lote según su número de campos: '1-4', '5-8', ..., '129+'."""
+    lower = 1
+    for limit in SHAPE_LIMITS:
+        if field_count <= limit:
+            return f"{lower}-{limit}"
+        lower = limit + 1
+    return f"{lower}+"
+
+
+def shape_bounds(shape):
+    """Límites (mínimo, máximo) de campos de una forma de lote."""
+    if shape.endswith("+"):
+        return int(shape[:-1]), math.inf
+    lower, upper = shape.split("-")
+    return int(lower), int(upper)
+
+
+class PlannedBatch:
+    """Campos de un lote y el max_tokens calculado para su respuesta."""
+
+    __slots__ = ("fields", "max_tokens", "shape", "prompt_tokens")
+
+    def __init__(self, fields, max_tokens, prompt_tokens):
+        self.fields = fields
+        self.max_tokens = max_tokens
+        self.prompt_tokens = prompt_tokens
+        self.shape = batch_shape(len(fields))
+
+    def __len__(self):
+        return len(self.fields)
+
+
+class ShapeStats:
+    """Resultados recientes de una forma de lote y su margen de salida."""
+
+    def __init__(self, window):
+        self.calls = 0
+        self.truncated = 0
+        self.parse_failures = 0
+        self.recent = deque(maxlen=window)
+        self.output_factor = 1.0
+        # Momento en que se dejó de generar esta forma por fallos, o None
+        self.excluded_at = None
+
+    def rates(self):
+        if not self.recent:
+            return 0.0, 0.0
+        truncated = sum(1 for t, _ in self.recent if t) / len(self.recent)
+        failed = sum(1 for _, f in self.recent if f) / len(self.recent)
+        return truncated, failed
+
+
+class BatchPlanner:
+    """Reparte los campos en lotes según un presupuesto de tokens por llamada.
+
+    Cada campo cuesta sus tokens en el prompt (la línea de la lista, y el
+    esquema en modo estructurado) más los que ocuparía su valor en la
+    respuesta. Los campos se empaquetan en orden hasta llenar el presupuesto,
+    y max_tokens se ajusta a la salida prevista de cada lote.
+
+    El planificador se ajusta solo: si una forma de lote se corta por
+    max_tokens (finish_reason 'length'), se amplía su margen de salida; si
+    falla al parsearse con frecuencia, y bastante más que los lotes más
+    pequeños, se deja de generar lotes de ese tamaño durante reprobe_after
+    segundos; después se vuelve a probar. El límite nunca baja de min_fields.
+    """
+
+    def __init__(self, prompt_line, token_budget=6000, max_fields=40,
+                 value_tokens=12, min_output_tokens=150, max_output_tokens=2000,
+                 window=50, min_samples=20, max_parse_failure_rate=0.2,
+                 max_output_factor=3.0, min_fields=8, size_failure_margin=0.1,
+                 reprobe_after=300, sanitizer=None):
+        self.prompt_line = prompt_line
+        self.token_budget = token_budget
+        self.max_fields = max_fields
+        self.value_tokens = value_tokens
+        self.min_output_tokens = min_output_tokens
+        self.max_output_tokens = max_output_tokens
+        self.window = window
+        self.min_samples = min_samples
+        self.max_parse_failure_rate = max_parse_failure_rate
+        self.max_output_factor = max_output_factor
+        self.min_fields = min_fields
+        self.size_failure_margin = size_failure_margin
+        self.reprobe_after = reprobe_after
+        self.sanitizer = sanitizer
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, shape):
+        stats = self._shapes.get(shape)
+        if stats is None:
+            stats = self._shapes[shape] = ShapeStats(self.window)
+        return stats
+
+    def field_tokens(self, field, mode="text"):
+        """Tokens de prompt y de respuesta previstos para un campo."""
+        prompt = estimate_tokens(self.prompt_line(field)) + 2
+        if mode == "structured":
+            # El nombre y las opciones se repiten en el esquema de la herramienta
+            prompt *= 2
+
+        # En la respuesta: la clave entre comillas y el valor más largo esperable
+        options = field_options(field, self.sanitizer)
+        value = max(estimate_tokens(o) for o in options) if options else self.value_tokens
+        return prompt, estimate_tokens(field) + value + 4
+
+    def output_factor(self, shape):
+        with self._lock:
+            stats = self._shapes.get(shape)
+            return stats.output_factor if stats else 1.0
+
+    def _smaller_failure_rate(self, lower):
+        """Tasa de fallos reciente de los lotes más pequeños que 'lower', o None."""
+        samples = [
+            failed for shape, stats in self._shapes.items()
+            if shape_bounds(shape)[1] < lower
+            for _, failed in stats.recent
+        ]
+        if len(samples) < self.min_samples:
+            return None
+        return sum(1 for failed in samples if failed) / len(samples)
+
+    def _excluded(self, shape, stats, now):
+        if len(stats.recent) < self.min_samples:
+            return False
+        _, failed = stats.rates()
+        if failed <= self.max_parse_failure_rate:
+            stats.excluded_at = None
+            return False
+        # Si los lotes pequeños fallan igual, el tamaño no es la causa
+        baseline = self._smaller_failure_rate(shape_bounds(shape)[0])
+        if baseline is not None and failed - baseline <= self.size_failure_margin:
+            stats.excluded_at = None
+            return False
+        if stats.excluded_at is None:
+            stats.excluded_at = now
+        elif now - stats.excluded_at >= self.reprobe_after:
+            # Volver a probar la forma: sus fallos antiguos dejan de contar
+            stats.recent.clear()
+            stats.excluded_at = None
+            return False
+        return True
+
+    def field_limit(self):
+        """Máximo de campos por lote, excluyendo las formas con demasiados fallos."""
+        limit = self.max_fields
+        now = time.monotonic()
+        with self._lock:
+            for shape, stats in self._shapes.items():
+                if self._excluded(shape, stats, now):
+                    limit = min(limit, shape_bounds(shape)[0] - 1)
+        return max(min(self.min_fields, self.max_fields), limit)
+
+    def max_tokens_for(self, output_tokens, field_count):
+        factor = self.output_factor(batch_shape(field_count))
+        # Margen fijo para las llaves, comas y algún espacio de más
+        tokens = math.ceil(output_tokens * factor) + 20
+        return max(self.min_output_tokens, min(self.max_output_tokens, tokens))
+
+    def plan(self, fields, fixed_tokens, mode="text", max_fields=None):
+        """Devuelve la lista de PlannedBatch para los campos, en su orden original.
+
+        fixed_tokens son los tokens que toda llamada paga igual: la plantilla
+        del prompt de sistema y la descripción del usuario.
+        """
+        limit = min(max_fields or self.max_fields, self.field_limit())
+        batches = []
+        current, prompt_sum, output_sum = [], 0, 0
+
+        def close():
+            batches.append(PlannedBatch(
+                current, self.max_tokens_for(output_sum, len(current)),
+                fixed_tokens + prompt_sum))
+
+        for field in fields:
+            prompt, output = self.field_tokens(field, mode)
+            if current:
+                projected = (fixed_tokens + prompt_sum + prompt
+                             + self.max_tokens_for(output_sum + output, len(current) + 1))
+                if len(current) >= limit or projected > self.token_budget:
+                    close()
+                    current, prompt_sum, output_sum = [], 0, 0
+            # Un campo que no cabe ni solo va en su propio lote
+            current.append(field)
+            prompt_sum += prompt
+            output_sum += output
+
+        if current:
+            close()
+        return batches
+
+    def record(self, shape, truncated=False, parse_failed=False):
+        """Registra el resultado de un lote y ajusta el margen de su forma."""
+        outcome = "truncated" if truncated else "parse_failed" if parse_failed else "ok"
+        planned_batches.inc(shape=shape, outcome=outcome)
+        with self._lock:
+            stats = self._stats(shape)
+            stats.calls += 1
+            stats.truncated += int(truncated)
+            stats.parse_failures += int(parse_failed)
+            stats.recent.append((truncated, parse_failed))
+            if truncated:
+                stats.output_factor = min(self.max_output_factor, stats.output_factor * 1.5)
+            else:
+                # Sin cortes, el margen vuelve poco a poco a la estimación base
+                stats.output_factor = max(1.0, stats.output_factor * 0.98)
+
+    def stats(self):
+        with self._lock:
+            shapes = {}
+            for shape, stats in sorted(self._shapes.items()):
+                truncated, failed = stats.rates()
+                shapes[shape] = {
+                    "calls": stats.calls,
+                    "truncated": stats.truncated,
+                    "parse_failures": stats.parse_failures,
+                    "recent_truncation_rate": round(truncated, 4),
+                    "recent_parse_failure_rate": round(failed, 4),
+                    "output_factor": round(stats.output_factor, 3),
+                    "excluded": stats.excluded_at is not None,
+                }
+        return {
+            "token_budget": self.token_budget,
+            "max_fields": self.max_fields,
+            "min_fields": self.min_fields,
+            "field_limit": self.field_limit(),
+            "shapes": shapes,
+        }
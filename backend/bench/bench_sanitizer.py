@@ -0,0 +1,87 @@
+"""Microbenchmark del filtrado de valores extraídos.
+
+Compara el filtrado original (lista reconstruida por lote y recorrida por
+campo) con ResponseSanitizer sobre respuestas de extracción grandes.
+
+Uso (desde backend/):
+    python bench/bench_sanitizer.py --fields 500 --repeat 200
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sanitizer import ResponseSanitizer  # noqa: E402
+
+
+def legacy_filter(extracted_json):
+    """Copia del filtrado que hacía extract_project_data antes del módulo sanitizer."""
+    unwanted_values = [
+        "no mencionado", "no especificado", "no disponible", "no indicado",
+        "desconocido", "sin especificar", "n/a", "na", "no aplica",
+        "-- selecciona --", "seleccione", "selecciona",
+        "no se especifica", "por determinar", "por definir",
+        "false", "true", "none", "null", "undefined", "ninguno", "ninguna",
+        "dato no proporcionado", "información no disponible", "vacio", "vacío",
+        "no hay datos", "pendiente", "a confirmar",
+        "NO MENCIONADO", "NO ESPECIFICADO", "NO DISPONIBLE", "NINGUNO", "NINGUNA",
+        "normal", "estándar", "estandar", "regular", "común", "comun",
+        "varios", "multiple", "multiples", "múltiples"
+    ]
+    filtered_json = {}
+    for field, value in extracted_json.items():
+        if isinstance(value, str):
+            normalized = value.lower().strip().strip('.').strip(',')
+            if len(normalized) < 2 and not normalized.isdigit():
+                continue
+            if normalized in [u.lower() for u in unwanted_values] or any(
+                u.lower() in normalized for u in [
+                    "no mencionado", "no especificado", "ninguno", "no disponible"
+                ]
+            ):
+                continue
+            filtered_json[field] = value
+        elif value is not None and value != False:
+            filtered_json[field] = value
+    return filtered_json
+
+
+SAMPLE_VALUES = [
+    "9,6 m", "Almería", "No mencionado", "ninguno", "Gótico", "Policarbonato",
+    "no disponible en el texto", "Estándar", "3", "12 ha", "Riego por goteo",
+    "Pendiente", "A (Estimada)", True, False, None, 42,
+]
+
+
+def build_payload(fields, seed=0):
+    rng = random.Random(seed)
+    return {f"Campo {i}": rng.choice(SAMPLE_VALUES) for i in range(fields)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fields", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    payload = build_payload(args.fields)
+    sanitizer = ResponseSanitizer(field_rules=[])
+
+    # Ambos filtros deben producir exactamente lo mismo
+    assert legacy_filter(payload) == sanitizer.sanitize(payload)
+
+    legacy = timeit.timeit(lambda: legacy_filter(payload), number=args.repeat)
+    current = timeit.timeit(lambda: sanitizer.sanitize(payload), number=args.repeat)
+
+    per_field = 1e9 / (args.fields * args.repeat)
+    print(f"Campos por respuesta: {args.fields}, repeticiones: {args.repeat}")
+    print(f"  legacy:    {legacy * per_field:8.1f} ns/campo")
+    print(f"  sanitizer: {current * per_field:8.1f} ns/campo")
+    print(f"  mejora:    {legacy / current:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Comprobación de la transcripción por segmentos con un backend falso.
+
+Genera un WAV sintético en el que cada muestra codifica el índice de la
+palabra que se "dice" en ese instante. El cliente falso decodifica las
+muestras de cada segmento y devuelve esas palabras, así que el texto unido
+debe coincidir exactamente con el guion original: cualquier palabra repetida
+o perdida en los solapamientos hace fallar la comprobación.
+
+Uso (desde backend/):
+    python bench/chunked_transcription.py --words 400 --segment 20 --overlap 3
+"""
+import argparse
+import array
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import types
+import wave
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "sk-local-fake")
+# Fuera de backend/ por si algún escenario usa el modo asíncrono
+os.environ.setdefault(
+    "JOBS_DB_PATH", os.path.join(tempfile.gettempdir(), "chatbot-bench-jobs.db"))
+
+import app as backend  # noqa: E402
+from audio_segments import split_wav, stitch_transcripts  # noqa: E402
+
+RATE = 8000
+WORD_SECONDS = 0.5
+
+
+def synthetic_wav(words):
+    samples = array.array("h")
+    for index in range(len(words)):
+        samples.extend([index + 1] * int(RATE * WORD_SECONDS))
+    out = io.BytesIO()
+    with wave.open(out, "wb") as writer:
+        writer.setnchannels(1)
+        writer.setsampwidth(2)
+        writer.setframerate(RATE)
+        writer.writeframes(samples.tobytes())
+    return out.getvalue()
+
+
+class FakeWordClient:
+    """Devuelve las palabras cuyas muestras aparecen en el segmento recibido."""
+
+    def __init__(self, words, latency):
+        self.words = words
+        self.latency = latency
+        self.calls = 0
+        self.audio = types.SimpleNamespace(
+            transcriptions=types.SimpleNamespace(create=self.create))
+
+    def create(self, model, file, language=None, **kwargs):
+        self.calls += 1
+        _, stream, _ = file
+        with wave.open(stream, "rb") as reader:
+            samples = array.array("h", reader.readframes(reader.getnframes()))
+        indices = []
+        for value in samples:
+            if not indices or indices[-1] != value:
+                indices.append(value)
+        time.sleep(self.latency)
+        return types.SimpleNamespace(text=" ".join(self.words[i - 1] for i in indices))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--words", type=int, default=400)
+    parser.add_argument("--segment", type=float, default=20.0)
+    parser.add_argument("--overlap", type=float, default=3.0)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    words = [f"palabra{i}" for i in range(args.words)]
+    wav = synthetic_wav(words)
+    expected = " ".join(words)
+
+    # 1. Unión directa de los segmentos, sin pasar por Flask
+    fake = FakeWordClient(words, 0)
+    segments = split_wav(wav, args.segment, args.overlap)
+    texts = [fake.create("fake", ("s.wav", io.BytesIO(s.data), "audio/wav")).text
+             for s in segments]
+    stitched = stitch_transcripts(texts)
+    print(f"Segmentos: {len(segments)}; unión correcta: {stitched == expected}")
+
+    # 2. Endpoint en streaming con segmentos en paralelo
+    backend.TRANSCRIBE_SEGMENT_SECONDS = args.segment
+    backend.TRANSCRIBE_SEGMENT_OVERLAP = args.overlap
+    backend.openai_client = FakeWordClient(words, args.latency)
+    client = backend.app.test_client()
+
+    start = time.perf_counter()
+    response = client.post(
+        "/transcribe_audio?mode=chunked&stream=1",
+        data={"audio": (io.BytesIO(wav), "nota.wav")},
+        content_type="multipart/form-data",
+    )
+    frames = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    elapsed = time.perf_counter() - start
+
+    final = frames[-1]
+    partials = sum(1 for f in frames if f["type"] == "partial")
+    print(f"Endpoint: {elapsed:.2f}s, {partials} parciales, "
+          f"texto final correcto: {final['text'] == expected}")
+
+    if stitched != expected or final["text"] != expected:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
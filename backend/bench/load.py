@@ -0,0 +1,405 @@
+"""Pruebas de carga de los endpoints del backend.
+
+Arranca el backend en un subproceso con el proveedor LLM falso
+(LLM_PROVIDER=fake) y un ERP simulado en este proceso, lanza cada escenario
+con los niveles de concurrencia y tamaños de lista de preguntas indicados y
+mide latencia p50/p95/p99, peticiones por segundo y memoria máxima (RSS)
+del servidor. Los resultados se guardan en JSON para comparar versiones.
+
+Uso (desde backend/):
+    python bench/load.py --concurrency 1,8,32 --sizes 10,100,500 --requests 50
+    python bench/load.py --output nuevo.json --compare base.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# ---------------------------------------------------------------------------
+# ERP simulado
+# ---------------------------------------------------------------------------
+
+def build_catalogue(size):
+    questions = []
+    for i in range(size):
+        question = {
+            "IDQuestion": i + 1,
+            "Description": f"Pregunta {i + 1} del proyecto",
+            "Orden": i + 1,
+            "Type": 3 if i % 4 == 0 else 1,
+            "Required": i % 5 == 0,
+        }
+        if question["Type"] == 3:
+            question["Answers"] = [
+                {"CodAnswer": j, "Description": f"Opción {j}"} for j in range(1, 6)
+            ]
+        questions.append(question)
+    return {"data": questions}
+
+
+def start_fake_erp(latency):
+    bodies = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            # El tamaño del catálogo lo indica la propia petición
+            raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            size = int((json.loads(raw or b"{}") or {}).get("size", 10))
+            if size not in bodies:
+                bodies[size] = json.dumps(build_catalogue(size)).encode("utf-8")
+            body = bodies[size]
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ---------------------------------------------------------------------------
+# Servidor bajo prueba
+# ---------------------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_backend(mode, port, erp_url, args, workdir):
+    env = dict(os.environ)
+    env.update({
+        "LLM_PROVIDER": "fake",
+        "FAKE_LLM_LATENCY": str(args.llm_latency),
+        "FAKE_LLM_JITTER": str(args.llm_jitter),
+        "OPENAI_API_KEY": "sk-local-fake",
+        "ERP_BASE_URL": erp_url,
+        "ERP_CONSULT_CACHE_TTL": str(args.erp_cache_ttl),
+        "EXTRACTION_CACHE_BACKEND": args.extraction_cache,
+        "QUESTION_STORE_PATH": os.path.join(workdir, "question_store.json"),
+        "QUESTION_STORE_AUTOWARM": "0",
+        "SESSION_DB_PATH": os.path.join(workdir, "sessions.db"),
+        "JOBS_DB_PATH": os.path.join(workdir, "jobs.db"),
+        # Activo para que 'extract_filtered' lo mida; 'extract' envía fullScan
+        "EXTRACTION_RELEVANCE_FILTER": "1",
+        "SERVER_HOST": "127.0.0.1",
+        "SERVER_PORT": str(port),
+        "SERVER_SSL": "0",
+        "LOG_LEVEL": "WARNING",
+    })
+
+    if mode == "gevent":
+        command = [sys.executable, "server.py"]
+    else:
+        command = [
+            sys.executable, "-c",
+            "from werkzeug.serving import run_simple; import app; "
+            f"run_simple('127.0.0.1', {port}, app.app, threaded=True)",
+        ]
+
+    process = subprocess.Popen(
+        command, cwd=BACKEND_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"El backend terminó al arrancar (código {process.returncode})")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/sessions/stats", timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("El backend no respondió a tiempo")
+
+
+def peak_rss_kb(pid):
+    """VmHWM (pico de memoria residente) del proceso, solo en Linux."""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Escenarios: cada uno hace una "operación" y lanza excepción si falla
+# ---------------------------------------------------------------------------
+
+def question_prompts(size):
+    catalogue = build_catalogue(size)["data"]
+    prompts = []
+    for q in catalogue:
+        prompt = q["Description"]
+        if q.get("Answers"):
+            prompt += " (opciones: " + ", ".join(a["Description"] for a in q["Answers"]) + ")"
+        prompts.append(prompt)
+    return prompts
+
+
+def check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+    return response
+
+
+def post_extraction(http, base, size, i, ctx, full_scan):
+    prompts = ctx.setdefault(("prompts", size), question_prompts(size))
+    check(http.post(f"{base}/extract_project_data", json={
+        # Descripción distinta en cada operación para no medir la caché
+        "description": f"Invernadero multitúnel de 9,6 m de ancho en Almería, proyecto {i}",
+        "questionDescriptions": prompts,
+        "fullScan": full_scan,
+    }))
+
+
+def scenario_extract(http, base, size, i, ctx):
+    # Sin el prefiltro de relevancia, para que el coste siga al tamaño de la lista
+    post_extraction(http, base, size, i, ctx, full_scan=True)
+
+
+def scenario_extract_filtered(http, base, size, i, ctx):
+    # Con el prefiltro: como mucho RELEVANCE_TOP_K campos llegan al modelo
+    post_extraction(http, base, size, i, ctx, full_scan=False)
+
+
+def scenario_generate_question(http, base, size, i, ctx):
+    # Campo nuevo en cada operación: mide la generación, no el almacén
+    check(http.post(f"{base}/generate_question", json={
+        "input": f"Dato {i}-{random.random():.6f} de {size}",
+    }))
+
+
+def scenario_transcribe(http, base, size, i, ctx):
+    audio = ctx.setdefault("audio", os.urandom(ctx["audio_bytes"]))
+    check(http.post(f"{base}/transcribe_audio", files={
+        "audio": (f"grabacion-{i}.webm", io.BytesIO(audio), "audio/webm"),
+    }))
+
+
+def scenario_session_sequential(http, base, size, i, ctx):
+    session_id = f"bench-seq-{i}-{random.random():.6f}"
+    check(http.post(f"{base}/start", json={"session_id": session_id, "existing_answers": {}}))
+    for field in range(size):
+        check(http.post(f"{base}/answer", json={
+            "session_id": session_id, "answer": {str(field + 1): f"valor {field}"},
+        }))
+
+
+def scenario_session_bulk(http, base, size, i, ctx):
+    check(http.post(f"{base}/answers", json={
+        "session_id": f"bench-bulk-{i}-{random.random():.6f}",
+        "answers": {str(field + 1): f"valor {field}" for field in range(size)},
+        "reset": True,
+    }))
+
+
+def scenario_erp_proxy(http, base, size, i, ctx):
+    check(http.post(
+        f"{base}/api/HTDV2/consult", json={"size": size},
+        headers={"Authorization": f"Bearer usuario-{i % 4}"},
+    ))
+
+
+SCENARIOS = {
+    "extract": scenario_extract,
+    "extract_filtered": scenario_extract_filtered,
+    "generate_question": scenario_generate_question,
+    "transcribe": scenario_transcribe,
+    "session_sequential": scenario_session_sequential,
+    "session_bulk": scenario_session_bulk,
+    "erp_proxy": scenario_erp_proxy,
+}
+
+# Escenarios cuyo coste depende del tamaño de la lista de preguntas
+SIZED_SCENARIOS = {"extract", "extract_filtered", "session_sequential", "session_bulk", "erp_proxy"}
+
+
+# ---------------------------------------------------------------------------
+# Ejecución y estadísticas
+# ---------------------------------------------------------------------------
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def run_level(func, base, size, concurrency, total, ctx):
+    local = threading.local()
+
+    def one(i):
+        # Una sesión HTTP keep-alive por hilo, como haría un navegador
+        if not hasattr(local, "http"):
+            local.http = requests.Session()
+        start = time.perf_counter()
+        try:
+            func(local.http, base, size, i, ctx)
+            return time.perf_counter() - start, None
+        except Exception as e:
+            return time.perf_counter() - start, str(e)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(one, range(total)))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(lat for lat, err in outcomes if err is None)
+    errors = [err for _, err in outcomes if err is not None]
+    to_ms = lambda v: round(v * 1000, 2) if v is not None else None  # noqa: E731
+    return {
+        "requests": total,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "wall_s": round(wall, 3),
+        "rps": round(len(latencies) / wall, 2) if wall else None,
+        "p50_ms": to_ms(percentile(latencies, 50)),
+        "p95_ms": to_ms(percentile(latencies, 95)),
+        "p99_ms": to_ms(percentile(latencies, 99)),
+        "max_ms": to_ms(latencies[-1] if latencies else None),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    index = {
+        (r["scenario"], r["size"], r["concurrency"]): r for r in baseline["results"]
+    }
+    print(f"\nComparación con {baseline_path} ({baseline.get('git_revision')}):")
+    print(f"{'escenario':<20}{'tam':>6}{'conc':>6}{'p95 antes':>12}{'p95 ahora':>12}"
+          f"{'rps antes':>12}{'rps ahora':>12}")
+    for r in current["results"]:
+        old = index.get((r["scenario"], r["size"], r["concurrency"]))
+        if not old:
+            continue
+        print(f"{r['scenario']:<20}{r['size']:>6}{r['concurrency']:>6}"
+              f"{old['p95_ms'] or 0:>12}{r['p95_ms'] or 0:>12}"
+              f"{old['rps'] or 0:>12}{r['rps'] or 0:>12}")
+
+
+def parse_list(value, cast=int):
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="escenarios separados por comas")
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--sizes", default="10,100,500",
+                        help="tamaños de la lista de preguntas")
+    parser.add_argument("--requests", type=int, default=50,
+                        help="operaciones por escenario, tamaño y concurrencia")
+    parser.add_argument("--server", choices=["flask", "gevent"], default="flask")
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--llm-jitter", type=float, default=0.1)
+    parser.add_argument("--erp-latency", type=float, default=0.05)
+    parser.add_argument("--erp-cache-ttl", type=int, default=0)
+    parser.add_argument("--extraction-cache", default="none")
+    parser.add_argument("--audio-bytes", type=int, default=200_000)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="resultados JSON anteriores para comparar")
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Escenarios desconocidos: {', '.join(sorted(unknown))}")
+
+    sizes = parse_list(args.sizes)
+    levels = parse_list(args.concurrency)
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    erp = start_fake_erp(args.erp_latency)
+    port = free_port()
+    backend = start_backend(
+        args.server, port, f"http://127.0.0.1:{erp.server_port}", args, workdir)
+    base = f"http://127.0.0.1:{port}"
+
+    results = []
+    ctx = {"audio_bytes": args.audio_bytes}
+    try:
+        for name in scenarios:
+            scenario_sizes = sizes if name in SIZED_SCENARIOS else [sizes[0]]
+            for size in scenario_sizes:
+                for concurrency in levels:
+                    stats = run_level(
+                        SCENARIOS[name], base, size, concurrency, args.requests, ctx)
+                    stats.update({
+                        "scenario": name,
+                        "size": size,
+                        "concurrency": concurrency,
+                        "server_peak_rss_kb": peak_rss_kb(backend.pid),
+                    })
+                    results.append(stats)
+                    print(f"{name:<20} tam={size:<4} conc={concurrency:<3} "
+                          f"p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms "
+                          f"p99={stats['p99_ms']}ms rps={stats['rps']} "
+                          f"errores={stats['errors']} rss={stats['server_peak_rss_kb']}kB")
+    finally:
+        backend.terminate()
+        try:
+            backend.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            backend.kill()
+        erp.shutdown()
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "args": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados guardados en {args.output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
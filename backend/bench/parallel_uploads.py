@@ -0,0 +1,96 @@
+"""Banco de pruebas de subidas de audio en paralelo contra /transcribe_audio.
+
+Sustituye el cliente de OpenAI por uno falso que devuelve el sha256 del
+audio recibido, lanza muchas subidas simultáneas con contenido distinto y
+comprueba que cada respuesta corresponde a su propio audio (sin colisiones)
+y que nunca hay más transcripciones en curso que las permitidas.
+
+Uso (desde backend/):
+    python bench/parallel_uploads.py --uploads 64 --threads 16 --size 600000
+"""
+import argparse
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "sk-local-fake")
+# Fuera de backend/ por si algún escenario usa el modo asíncrono
+os.environ.setdefault(
+    "JOBS_DB_PATH", os.path.join(tempfile.gettempdir(), "chatbot-bench-jobs.db"))
+
+import app as backend  # noqa: E402
+
+
+class FakeTranscriptionClient:
+    """Cliente local que imita client.audio.transcriptions.create."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.audio = types.SimpleNamespace(
+            transcriptions=types.SimpleNamespace(create=self.create))
+
+    def create(self, model, file, language=None, **kwargs):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            _, stream, _ = file
+            digest = hashlib.sha256(stream.read()).hexdigest()
+            time.sleep(self.latency)
+            return types.SimpleNamespace(text=digest)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def upload(client, index, size):
+    payload = os.urandom(size)
+    response = client.post(
+        "/transcribe_audio",
+        data={"audio": (io.BytesIO(payload), f"grabacion-{index}.webm")},
+        content_type="multipart/form-data",
+    )
+    expected = hashlib.sha256(payload).hexdigest()
+    return response.status_code, response.get_json().get("text") == expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uploads", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--size", type=int, default=600_000,
+                        help="bytes por subida (por encima de UPLOAD_SPOOL_BYTES va a disco)")
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    fake = FakeTranscriptionClient(args.latency)
+    backend.openai_client = fake
+    client = backend.app.test_client()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        results = list(executor.map(
+            lambda i: upload(client, i, args.size), range(args.uploads)))
+    elapsed = time.perf_counter() - start
+
+    ok = sum(1 for status, matches in results if status == 200 and matches)
+    limit = backend.TRANSCRIBE_MAX_CONCURRENCY
+    print(f"Subidas correctas: {ok}/{args.uploads} en {elapsed:.2f}s")
+    print(f"Transcripciones simultáneas: máximo {fake.max_in_flight} (límite {limit})")
+
+    if ok != args.uploads or fake.max_in_flight > limit:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Prueba de concurrencia de los almacenes de sesiones.
+
+Simula varios workers que actualizan las mismas sesiones a la vez: cada
+hilo usa su propia instancia del almacén (como un proceso de gunicorn),
+todas sobre el mismo fichero SQLite o el mismo servidor Redis, y suma 1 a
+un contador de la sesión en cada update(). Al final cada contador debe ser
+exactamente hilos x actualizaciones; cualquier diferencia es una
+actualización perdida. --think-ms alarga cada update() entre la lectura y
+la escritura para que las carreras se den con facilidad. El backend
+'memory' no se comparte entre procesos, así que ahí todos los hilos usan la
+misma instancia.
+
+Uso (desde backend/):
+    python bench/session_stores.py --backends memory,sqlite,fakeredis
+    python bench/session_stores.py --backends redis --redis-url redis://localhost:6379/15
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_store import (  # noqa: E402
+    FakeRedis,
+    MemorySessionStore,
+    RedisSessionStore,
+    SQLiteSessionStore,
+)
+
+
+def store_factory(backend, workdir, redis_url):
+    """Devuelve una función que crea una instancia del almacén por 'worker'."""
+    if backend == "memory":
+        shared = MemorySessionStore(ttl=3600)
+        return lambda: shared
+    if backend == "sqlite":
+        path = os.path.join(workdir, "sessions.db")
+        return lambda: SQLiteSessionStore(ttl=3600, path=path)
+    if backend == "fakeredis":
+        server = FakeRedis()
+        return lambda: RedisSessionStore(3600, server, prefix="bench:")
+    if backend == "redis":
+        import redis
+        return lambda: RedisSessionStore(
+            3600, redis.Redis.from_url(redis_url), prefix="bench:")
+    raise ValueError(f"Backend desconocido: {backend}")
+
+
+def make_increment(think_seconds):
+    def increment(session):
+        answers = session["answers"]
+        counter = answers.get("counter", 0)
+        if think_seconds:
+            time.sleep(think_seconds)
+        answers["counter"] = counter + 1
+    return increment
+
+
+def run(backend, args, workdir):
+    make_store = store_factory(backend, workdir, args.redis_url)
+    increment = make_increment(args.think_ms / 1000)
+    session_ids = [f"bench-{i}" for i in range(args.sessions)]
+    setup = make_store()
+    for session_id in session_ids:
+        setup.delete(session_id)
+
+    def worker(index):
+        store = make_store()
+        for i in range(args.updates):
+            session_id = session_ids[(index + i) % len(session_ids)]
+            store.update(session_id, increment, create=True)
+        return store
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        stores = list(executor.map(worker, range(args.workers)))
+    elapsed = time.perf_counter() - start
+
+    total = sum(setup.get(sid)["answers"]["counter"] for sid in session_ids)
+    expected = args.workers * args.updates
+    conflicts = sum(getattr(s, "conflicts", 0) for s in {id(s): s for s in stores}.values())
+    for session_id in session_ids:
+        setup.delete(session_id)
+    return {
+        "backend": backend,
+        "updates": expected,
+        "applied": total,
+        "lost": expected - total,
+        "conflicts": conflicts,
+        "updates_per_second": round(expected / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", default="memory,sqlite,fakeredis")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--updates", type=int, default=200,
+                        help="actualizaciones por worker")
+    parser.add_argument("--sessions", type=int, default=4,
+                        help="sesiones distintas (menos sesiones, más conflictos)")
+    parser.add_argument("--think-ms", type=float, default=0.5,
+                        help="pausa dentro de cada update(), en milisegundos")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as workdir:
+        for backend in args.backends.split(","):
+            result = run(backend.strip(), args, workdir)
+            failed |= result["lost"] > 0
+            print(f"{result['backend']:>10}  {result['applied']}/{result['updates']} aplicadas  "
+                  f"perdidas={result['lost']}  conflictos={result['conflicts']}  "
+                  f"{result['updates_per_second']} act/s")
+
+    if failed:
+        print("ERROR: se han perdido actualizaciones")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import os
+import ssl
+import tempfile
+
+from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, PrivateFormat
+from cryptography.hazmat.primitives.serialization.pkcs12 import load_key_and_certificates
+
+
+# Ajusta esta ruta a donde esté tu .pfx en Linux
+# "/home/practicas-ti/ChatBot/backend/novagric-2026.pfx"
+PFX_PATH = os.getenv("PFX_PATH", "./novagric-2026.pfx")
+PFX_PASSWORD = os.getenv("PFX_PASSWORD", "2j70m86a9")
+
+
+def load_pfx_to_temp(pfx_path, pfx_password):
+    # 1. Leer bytes del PFX
+    with open(pfx_path, "rb") as f:
+        pfx_data = f.read()
+
+    # 2. Extraer clave, certificado y CA intermedias
+    private_key, cert, additional_certs = load_key_and_certificates(
+        pfx_data,
+        pfx_password.encode("utf-8"),
+        None
+    )
+
+    # 3. Volcar todo en un único PEM temporal
+    pem_file = tempfile.NamedTemporaryFile(delete=False, suffix=".pem")
+    with open(pem_file.name, "wb") as out:
+        # Clave privada en PKCS8
+        out.write(private_key.private_bytes(
+            encoding=Encoding.PEM,
+            format=PrivateFormat.PKCS8,
+            encryption_algorithm=NoEncryption()
+        ))
+        # Certificado principal
+        out.write(cert.public_bytes(Encoding.PEM))
+        # Cualquier CA intermedia
+        if additional_certs:
+            for ca in additional_certs:
+                out.write(ca.public_bytes(Encoding.PEM))
+
+    return pem_file.name
+
+
+def build_ssl_context(pfx_path=PFX_PATH, pfx_password=PFX_PASSWORD):
+    """Convierte el PFX en un PEM temporal y crea el contexto SSL del servidor.
+
+    Devuelve (contexto, ruta_pem); quien llama debe borrar el PEM al terminar.
+    """
+    # Convertimos el PFX → un único PEM que contiene clave+certificados
+    pem_path = load_pfx_to_temp(pfx_path, pfx_password)
+    try:
+        # Creamos el contexto SSL y cargamos el PEM como certfile y keyfile
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile=pem_path, keyfile=pem_path)
+    except Exception:
+        os.unlink(pem_path)
+        raise
+    return context, pem_path
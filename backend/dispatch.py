@@ -0,0 +1,76 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class BatchResult:
+    """Resultado de una tarea despachada: valor, error y duración en segundos."""
+
+    __slots__ = ("index", "value", "error", "elapsed")
+
+    def __init__(self, index, value=None, error=None, elapsed=0.0):
+        self.index = index
+        self.value = value
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _run_one(func, index, item):
+    start = time.perf_counter()
+    try:
+        value = func(item)
+        return BatchResult(index, value=value, elapsed=time.perf_counter() - start)
+    except Exception as e:
+        # Un lote que falla no cancela al resto: se devuelve el error
+        return BatchResult(index, error=e, elapsed=time.perf_counter() - start)
+
+
+def dispatch_ordered(func, items, max_workers):
+    """Ejecuta func sobre cada item con como máximo max_workers en vuelo.
+
+    Devuelve una lista de BatchResult en el mismo orden que items, de modo que
+    quien combine los resultados obtenga siempre la misma salida.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    max_workers = max(1, min(int(max_workers), len(items)))
+
+    # Con un único hilo no merece la pena crear un pool
+    if max_workers == 1:
+        return [_run_one(func, i, item) for i, item in enumerate(items)]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_run_one, func, i, item) for i, item in enumerate(items)
+        ]
+        return [future.result() for future in futures]
+
+
+def dispatch_as_completed(func, items, max_workers):
+    """Como dispatch_ordered, pero produce cada BatchResult en cuanto termina.
+
+    Los resultados llegan en orden de finalización; BatchResult.index indica
+    la posición original para poder recombinarlos de forma determinista.
+    """
+    items = list(items)
+    if not items:
+        return
+
+    max_workers = max(1, min(int(max_workers), len(items)))
+
+    if max_workers == 1:
+        for i, item in enumerate(items):
+            yield _run_one(func, i, item)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_run_one, func, i, item) for i, item in enumerate(items)
+        ]
+        for future in as_completed(futures):
+            yield future.result()
@@ -0,0 +1,86 @@
+import hashlib
+import logging
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from extraction_cache import MemoryCache, NullCache, make_cache_key
+from metrics import REGISTRY, span
+
+
+logger = logging.getLogger("erp_client")
+
+erp_requests = REGISTRY.counter(
+    "chatbot_erp_requests_total",
+    "Consultas al ERP según se sirvan desde la caché o desde la API",
+    ("path", "source", "status"),
+)
+
+
+class ERPClient:
+    """Cliente HTTP compartido para la API del ERP.
+
+    Reutiliza conexiones keep-alive (sin un handshake TLS por petición) y
+    puede cachear durante unos segundos la respuesta de 'consult', que es el
+    catálogo de preguntas y casi no cambia.
+    """
+
+    def __init__(self, base_url, pool_connections=4, pool_maxsize=16,
+                 connect_timeout=5.0, read_timeout=30.0, cache_ttl=0,
+                 cache_max_entries=256):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.cache = (
+            MemoryCache(cache_ttl, max_entries=cache_max_entries)
+            if cache_ttl > 0 else NullCache(0)
+        )
+
+    @staticmethod
+    def principal(auth_header):
+        # Se usa el token completo: cachear por un campo decodificado sin
+        # verificar permitiría leer respuestas de otro usuario con un token falso
+        return hashlib.sha256(auth_header.encode("utf-8")).hexdigest()
+
+    def post(self, path, auth_header, body):
+        """Reenvía la petición al ERP. Devuelve (status, json)."""
+        start = time.perf_counter()
+        status = None
+        try:
+            with span("erp.upstream"):
+                response = self.session.post(
+                    f"{self.base_url}{path}",
+                    headers={
+                        "Authorization": auth_header,
+                        "Content-Type": "application/json",
+                    },
+                    json=body,
+                    timeout=self.timeout,
+                    verify=True,  # La API externa usa HTTPS con un certificado válido
+                )
+                status = response.status_code
+                return status, response.json()
+        finally:
+            erp_requests.inc(path=path, source="upstream", status=status or "error")
+            logger.info(
+                "erp_upstream path=%s status=%s elapsed_ms=%.1f",
+                path, status, (time.perf_counter() - start) * 1000,
+            )
+
+    def consult(self, auth_header, body):
+        """Consulta el catálogo de preguntas. Devuelve (status, json, desde_caché)."""
+        cache_key = make_cache_key("consult", self.principal(auth_header), body)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            erp_requests.inc(path="/api/HTDV2/consult", source="cache", status=200)
+            return 200, cached, True
+
+        status, payload = self.post("/api/HTDV2/consult", auth_header, body)
+        # Solo se cachean las respuestas correctas
+        if status == 200:
+            self.cache.set(cache_key, payload)
+        return status, payload, False
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_cache_key(*parts):
+    """Genera una clave estable (sha256) a partir de las partes indicadas."""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class BaseCache:
+    """Interfaz común de las cachés con contadores de aciertos y fallos."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def _record(self, hit):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        value = self._get(key)
+        self._record(value is not None)
+        return value
+
+    def set(self, key, value):
+        self._set(key, value)
+
+    def stats(self):
+        with self._stats_lock:
+            total = self.hits + self.misses
+            return {
+                "backend": type(self).__name__,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "entries": self.size(),
+            }
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def size(self):
+        raise NotImplementedError
+
+
+class NullCache(BaseCache):
+    """Caché desactivada: nunca guarda nada."""
+
+    def _get(self, key):
+        return None
+
+    def _set(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+    def size(self):
+        return 0
+
+
+class MemoryCache(BaseCache):
+    """Caché LRU en memoria del proceso con caducidad por TTL."""
+
+    def __init__(self, ttl, max_entries=1024):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def _set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def size(self):
+        with self._lock:
+            return len(self._data)
+
+
+class SQLiteCache(BaseCache):
+    """Caché persistente en SQLite que sobrevive a los reinicios."""
+
+    def __init__(self, ttl, path="extraction_cache.db"):
+        super().__init__(ttl)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                with self._conn:
+                    self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            return json.loads(row[0])
+
+    def _set(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time() + self.ttl),
+            )
+
+    def purge_expired(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache")
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+def build_cache(backend, ttl, max_entries=1024, path="extraction_cache.db"):
+    """Crea la caché indicada por nombre: 'memory', 'sqlite' o 'none'."""
+    backend = (backend or "none").lower()
+    if backend == "memory":
+        return MemoryCache(ttl, max_entries=max_entries)
+    if backend == "sqlite":
+        cache = SQLiteCache(ttl, path=path)
+        cache.purge_expired()
+        return cache
+    if backend == "none":
+        return NullCache(ttl)
+    raise ValueError(f"Backend de caché desconocido: {backend}")
@@ -0,0 +1,381 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from metrics import REGISTRY
+
+
+logger = logging.getLogger("jobs")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED = (DONE, FAILED, CANCELLED)
+
+jobs_total = REGISTRY.counter(
+    "chatbot_jobs_total", "Trabajos en segundo plano por tipo y resultado", ("kind", "outcome"))
+job_seconds = REGISTRY.histogram(
+    "chatbot_job_duration_seconds", "Duración de los trabajos en segundo plano", ("kind",))
+
+
+class JobError(Exception):
+    """Error esperado de un trabajo: su mensaje se devuelve tal cual al cliente."""
+
+
+class JobCancelled(Exception):
+    """El trabajo se ha cancelado mientras se ejecutaba."""
+
+
+def content_hash(kind, payload, data=None):
+    """Huella del trabajo para detectar envíos repetidos con el mismo contenido."""
+    digest = hashlib.sha256(kind.encode("utf-8"))
+    digest.update(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    if data is not None:
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobContext:
+    """Lo que recibe el manejador de un trabajo: sus datos y la cancelación."""
+
+    def __init__(self, queue, job_id, payload, data):
+        self.queue = queue
+        self.id = job_id
+        self.payload = payload
+        self.data = data
+
+    def cancelled(self):
+        return self.queue.cancel_requested(self.id)
+
+    def check_cancelled(self):
+        """Para llamar entre pasos largos: lanza JobCancelled si se ha pedido cancelar."""
+        if self.cancelled():
+            raise JobCancelled()
+
+
+class JobQueue:
+    """Cola de trabajos persistida en SQLite con un pool de hilos que los ejecuta.
+
+    Varios procesos pueden compartir el mismo fichero: cada trabajo se reclama
+    con una transacción BEGIN IMMEDIATE, así que solo lo ejecuta uno. Los
+    trabajos que quedaron a medias porque su proceso murió (o porque son de un
+    arranque anterior con el mismo PID, como el PID 1 de un contenedor
+    reiniciado) vuelven a la cola al arrancar. Los resultados se conservan
+    'retention' segundos y como mucho 'max_retained' trabajos terminados.
+    """
+
+    def __init__(self, path="jobs.db", workers=2, retention=3600, max_retained=1000,
+                 poll_interval=1.0):
+        self.path = path
+        self.workers = workers
+        self.retention = retention
+        self.max_retained = max_retained
+        self.poll_interval = poll_interval
+        self.handlers = {}
+        # Identifica este arranque: el PID solo no basta, se repite entre reinicios
+        self.instance_id = uuid.uuid4().hex
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(threading.Lock())
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._threads = []
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, content_hash TEXT NOT NULL, "
+                "status TEXT NOT NULL, payload TEXT NOT NULL, data BLOB, "
+                "result TEXT, error TEXT, cancel_requested INTEGER NOT NULL DEFAULT 0, "
+                "owner_pid INTEGER, owner_instance TEXT, created_at REAL NOT NULL, "
+                "started_at REAL, finished_at REAL)"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            if "owner_instance" not in columns:
+                # Ficheros creados antes de registrar la instancia propietaria
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN owner_instance TEXT")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_hash ON jobs (content_hash)")
+        self.requeue_orphans()
+
+    def register(self, kind, handler):
+        """handler(context) devuelve un resultado serializable a JSON."""
+        self.handlers[kind] = handler
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        sweeper = threading.Thread(target=self._sweep, name="job-sweeper", daemon=True)
+        sweeper.start()
+        self._threads.append(sweeper)
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    # -- Envío y consulta -------------------------------------------------
+
+    def submit(self, kind, payload, data=None, reuse_finished=True):
+        """Encola un trabajo. Devuelve (trabajo, nuevo).
+
+        Si ya hay uno con el mismo contenido en cola o en curso (o terminado
+        con éxito, si reuse_finished) se devuelve ese en lugar de crear otro;
+        los que se están cancelando no cuentan.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Tipo de trabajo desconocido: {kind}")
+        fingerprint = content_hash(kind, payload, data)
+        reusable = (QUEUED, RUNNING, DONE) if reuse_finished else (QUEUED, RUNNING)
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    f"SELECT id FROM jobs WHERE content_hash = ? AND status IN "
+                    f"({','.join('?' * len(reusable))}) AND cancel_requested = 0 "
+                    f"ORDER BY created_at DESC LIMIT 1",
+                    (fingerprint, *reusable),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute("COMMIT")
+                    return self.get(row[0]), False
+
+                job_id = uuid.uuid4().hex
+                self._conn.execute(
+                    "INSERT INTO jobs (id, kind, content_hash, status, payload, data, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, kind, fingerprint, QUEUED,
+                     json.dumps(payload, ensure_ascii=False), data, time.time()),
+                )
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+        self._notify()
+        return self.get(job_id), True
+
+    def get(self, job_id):
+        """Estado del trabajo como diccionario, o None si no existe."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, kind, status, result, error, cancel_requested, "
+                "created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = {
+            "id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "cancel_requested": bool(row[5]),
+            "created_at": row[6],
+            "started_at": row[7],
+            "finished_at": row[8],
+        }
+        if row[3] is not None:
+            job["result"] = json.loads(row[3])
+        if row[4] is not None:
+            job["error"] = row[4]
+        return job
+
+    def wait(self, job_id, timeout):
+        """Espera a que el trabajo termine (o venza el tiempo) y devuelve su estado."""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in FINISHED or remaining <= 0:
+                return job
+            # Otro proceso puede terminarlo sin avisar a este: se consulta periódicamente
+            with self._changed:
+                self._changed.wait(min(remaining, self.poll_interval))
+
+    def cancel(self, job_id):
+        """Cancela el trabajo. Devuelve su estado, o None si no existe.
+
+        Uno en cola se cancela al momento; uno en curso se marca y su
+        manejador lo detiene en el siguiente punto de comprobación.
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, data = NULL "
+                "WHERE id = ? AND status = ?",
+                (CANCELLED, time.time(), job_id, QUEUED),
+            )
+            self._conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?",
+                (job_id, RUNNING),
+            )
+        self._notify()
+        return self.get(job_id)
+
+    def cancel_requested(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {
+            "workers": self.workers,
+            "retention": self.retention,
+            "max_retained": self.max_retained,
+            "jobs": {status: count for status, count in rows},
+        }
+
+    # -- Ejecución ----------------------------------------------------------
+
+    def requeue_orphans(self):
+        """Devuelve a la cola los trabajos en curso cuyo proceso ya no existe.
+
+        Un trabajo de otra instancia con nuestro mismo PID es de un arranque
+        anterior: este proceso aún no ha reclamado nada con otro identificador.
+        """
+        pid = os.getpid()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, owner_pid, owner_instance FROM jobs WHERE status = ?",
+                (RUNNING,),
+            ).fetchall()
+            orphans = [
+                job_id for job_id, owner_pid, instance in rows
+                if instance != self.instance_id
+                and (not owner_pid or owner_pid == pid or not _pid_alive(owner_pid))
+            ]
+            for job_id in orphans:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, owner_pid = NULL, owner_instance = NULL, "
+                    "started_at = NULL WHERE id = ? AND status = ?",
+                    (QUEUED, job_id, RUNNING),
+                )
+        if orphans:
+            logger.warning("Trabajos interrumpidos devueltos a la cola: %d", len(orphans))
+        return len(orphans)
+
+    def _claim(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, kind, payload, data FROM jobs WHERE status = ? "
+                    "ORDER BY created_at LIMIT 1",
+                    (QUEUED,),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, owner_pid = ?, owner_instance = ?, "
+                        "started_at = ? WHERE id = ?",
+                        (RUNNING, os.getpid(), self.instance_id, time.time(), row[0]),
+                    )
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return row
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, "
+                "data = NULL WHERE id = ?",
+                (status,
+                 json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 error, time.time(), job_id),
+            )
+        self._notify()
+
+    def run_one(self):
+        """Ejecuta el siguiente trabajo de la cola. Devuelve False si no había ninguno."""
+        row = self._claim()
+        if row is None:
+            return False
+
+        job_id, kind, payload, data = row
+        context = JobContext(self, job_id, json.loads(payload), data)
+        start = time.perf_counter()
+        try:
+            result = self.handlers[kind](context)
+            if context.cancelled():
+                raise JobCancelled()
+        except Exception as e:
+            # Un error provocado por la cancelación cuenta como cancelación
+            if isinstance(e, JobCancelled) or context.cancelled():
+                self._finish(job_id, CANCELLED)
+                outcome = CANCELLED
+            elif isinstance(e, JobError):
+                self._finish(job_id, FAILED, error=str(e))
+                outcome = FAILED
+            else:
+                logger.exception("Error en el trabajo %s (%s)", job_id, kind)
+                self._finish(job_id, FAILED, error=f"Error interno: {e}")
+                outcome = FAILED
+        else:
+            self._finish(job_id, DONE, result=result)
+            outcome = DONE
+        jobs_total.inc(kind=kind, outcome=outcome)
+        job_seconds.observe(time.perf_counter() - start, kind=kind)
+        return True
+
+    def _work(self):
+        while True:
+            try:
+                if self.run_one():
+                    continue
+            except Exception as e:
+                logger.error("Error en el worker de trabajos: %s", e)
+            with self._changed:
+                self._changed.wait(self.poll_interval)
+
+    # -- Retención ----------------------------------------------------------
+
+    def evict(self):
+        """Borra los trabajos terminados caducados o que exceden max_retained."""
+        placeholders = ",".join("?" * len(FINISHED))
+        with self._lock:
+            removed = self._conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({placeholders}) AND finished_at < ?",
+                (*FINISHED, time.time() - self.retention),
+            ).rowcount
+            removed += self._conn.execute(
+                f"DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE status IN "
+                f"({placeholders}) ORDER BY finished_at DESC LIMIT -1 OFFSET ?)",
+                (*FINISHED, self.max_retained),
+            ).rowcount
+        return removed
+
+    def _sweep(self):
+        interval = max(1.0, min(60.0, self.retention / 10))
+        while True:
+            time.sleep(interval)
+            try:
+                removed = self.evict()
+                if removed:
+                    logger.info("Trabajos terminados eliminados: %d", removed)
+            except Exception as e:
+                logger.error("Error al limpiar trabajos terminados: %s", e)
@@ -0,0 +1,313 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import types
+
+from metrics import REGISTRY
+
+logger = logging.getLogger("llm")
+
+llm_call_seconds = REGISTRY.histogram(
+    "chatbot_llm_call_duration_seconds",
+    "Duración de cada llamada al modelo, reintentos incluidos",
+    ("endpoint", "outcome"),
+)
+llm_tokens = REGISTRY.counter(
+    "chatbot_llm_tokens_total",
+    "Tokens consumidos según el campo usage de la respuesta",
+    ("endpoint", "model", "kind"),
+)
+llm_retries = REGISTRY.counter(
+    "chatbot_llm_retries_total",
+    "Reintentos de llamadas al modelo tras errores transitorios",
+    ("endpoint",),
+)
+llm_rate_limited = REGISTRY.counter(
+    "chatbot_llm_rate_limited_total",
+    "Llamadas rechazadas por no obtener cupo de peticiones o tokens a tiempo",
+    ("endpoint",),
+)
+
+
+def estimate_tokens(text):
+    """Estimación rápida de tokens (~4 caracteres por token en español)."""
+    return max(1, len(text) // 4)
+
+
+def messages_tokens(messages):
+    return sum(estimate_tokens(m.get("content") or "") + 4 for m in messages)
+
+
+class EndpointConfig:
+    """Modelo, tiempo máximo y reintentos de las llamadas de un endpoint."""
+
+    def __init__(self, model, timeout=60.0, retries=2):
+        self.model = model
+        self.timeout = timeout
+        self.retries = retries
+
+    @classmethod
+    def from_env(cls, name, model, timeout=60.0, retries=2):
+        """Lee LLM_<NAME>_MODEL, LLM_<NAME>_TIMEOUT y LLM_<NAME>_RETRIES."""
+        prefix = f"LLM_{name.upper()}_"
+        return cls(
+            os.getenv(prefix + "MODEL", model),
+            timeout=float(os.getenv(prefix + "TIMEOUT", str(timeout))),
+            retries=int(os.getenv(prefix + "RETRIES", str(retries))),
+        )
+
+
+class TokenBucket:
+    """Cubo de tokens que se rellena a 'per_minute' unidades por minuto.
+
+    acquire() bloquea hasta que hay saldo suficiente o vence el tiempo. Un
+    límite de 0 desactiva el cubo.
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self._available = float(per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._available = min(
+            self.capacity, self._available + (now - self._updated) * self.per_minute / 60.0)
+        self._updated = now
+
+    def acquire(self, amount=1, timeout=None):
+        if not self.per_minute:
+            return True
+        # Una petición mayor que el cubo entero nunca cabría: se limita a la capacidad
+        amount = min(amount, self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._available >= amount:
+                    self._available -= amount
+                    return True
+                wait = (amount - self._available) * 60.0 / self.per_minute
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(min(wait, 1.0))
+
+
+class RateLimited(Exception):
+    """No se ha podido obtener cupo de peticiones o tokens a tiempo."""
+
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def is_retryable(error):
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    # Errores de conexión y timeouts del SDK de OpenAI no tienen status_code
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError", "TimeoutError")
+
+
+def backoff_delays(retries, base=0.5, cap=8.0, rng=random):
+    """Esperas con 'full jitter': aleatorias entre 0 y base * 2^intento."""
+    for attempt in range(retries):
+        yield rng.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class LLMClient:
+    """Punto único de acceso a los modelos de chat.
+
+    Aplica la configuración por endpoint, los límites de peticiones y tokens
+    por minuto y los reintentos con espera aleatoria. El proveedor es
+    cualquier objeto con la interfaz de OpenAI (client.chat.completions.create),
+    como el cliente real o FakeProvider.
+    """
+
+    def __init__(self, provider_getter, endpoints, requests_per_minute=0,
+                 tokens_per_minute=0, rate_limit_timeout=30.0):
+        self._provider_getter = provider_getter
+        self._last_provider = None
+        self._wrapped_provider = None
+        self.endpoints = endpoints
+        self.requests_bucket = TokenBucket(requests_per_minute)
+        self.tokens_bucket = TokenBucket(tokens_per_minute)
+        self.rate_limit_timeout = rate_limit_timeout
+
+    def _provider(self):
+        provider = self._provider_getter()
+        if provider is not self._last_provider:
+            # Los reintentos los gestiona LLMClient: desactivar los del SDK
+            self._last_provider = provider
+            self._wrapped_provider = (
+                provider.with_options(max_retries=0)
+                if hasattr(provider, "with_options") else provider
+            )
+        return self._wrapped_provider
+
+    def has(self, endpoint):
+        return endpoint in self.endpoints
+
+    def model_for(self, endpoint):
+        return self.endpoints[endpoint].model
+
+    def complete(self, endpoint, messages, max_tokens, **kwargs):
+        config = self.endpoints[endpoint]
+        provider = self._provider()
+
+        tokens = messages_tokens(messages) + max_tokens
+        start = time.perf_counter()
+        outcome = "error"
+        delays = backoff_delays(config.retries)
+        try:
+            while True:
+                # Cada intento es una petición más al proveedor: también los reintentos
+                # consumen cupo, para no saltarse el límite tras un 429
+                try:
+                    self._acquire(endpoint, tokens)
+                except RateLimited:
+                    outcome = "rate_limited"
+                    raise
+                try:
+                    completion = provider.chat.completions.create(
+                        model=config.model,
+                        messages=messages,
+                        max_tokens=max_tokens,
+                        timeout=config.timeout,
+                        **kwargs,
+                    )
+                    outcome = "ok"
+                    self._record_usage(endpoint, config.model, completion)
+                    return completion
+                except Exception as e:
+                    delay = next(delays, None) if is_retryable(e) else None
+                    if delay is None:
+                        raise
+                    llm_retries.inc(endpoint=endpoint)
+                    logger.warning(
+                        "Reintentando llamada a %s en %.2fs: %s", config.model, delay, e)
+                    time.sleep(delay)
+        finally:
+            llm_call_seconds.observe(
+                time.perf_counter() - start, endpoint=endpoint, outcome=outcome)
+
+    def _acquire(self, endpoint, tokens):
+        """Reserva una petición y sus tokens en los límites por minuto."""
+        if not self.requests_bucket.acquire(1, self.rate_limit_timeout):
+            llm_rate_limited.inc(endpoint=endpoint)
+            raise RateLimited("Límite de peticiones por minuto alcanzado")
+        if not self.tokens_bucket.acquire(tokens, self.rate_limit_timeout):
+            llm_rate_limited.inc(endpoint=endpoint)
+            raise RateLimited("Límite de tokens por minuto alcanzado")
+
+    @staticmethod
+    def _record_usage(endpoint, model, completion):
+        usage = getattr(completion, "usage", None)
+        if usage is None:
+            return
+        for kind in ("prompt_tokens", "completion_tokens"):
+            amount = getattr(usage, kind, None)
+            if amount:
+                llm_tokens.inc(amount, endpoint=endpoint, model=model, kind=kind[:-7])
+
+
+def _completion(content=None, tool_calls=None, prompt_tokens=0, completion_tokens=0):
+    """Objeto con la misma forma que la respuesta de chat.completions.create."""
+    message = types.SimpleNamespace(content=content, tool_calls=tool_calls)
+    return types.SimpleNamespace(
+        choices=[types.SimpleNamespace(message=message, finish_reason="stop")],
+        usage=types.SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        ),
+    )
+
+
+class FakeProvider:
+    """Proveedor local y determinista para pruebas de carga sin red.
+
+    Imita client.chat.completions.create y client.audio.transcriptions.create
+    con una latencia configurable. Las respuestas de chat salen de un guion
+    (lista de {"match": regex, "response": texto u objeto}) que se compara con
+    el último mensaje; si nada coincide, se responde con un JSON vacío o, para
+    las peticiones de preguntas, con una pregunta por campo.
+    """
+
+    def __init__(self, latency=0.5, jitter=0.0, script=None, seed=0):
+        self.api_key = "fake"
+        self.latency = latency
+        self.jitter = jitter
+        self.script = [
+            (re.compile(entry["match"], re.IGNORECASE | re.DOTALL), entry["response"])
+            for entry in (script or [])
+        ]
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.chat = types.SimpleNamespace(
+            completions=types.SimpleNamespace(create=self._chat))
+        self.audio = types.SimpleNamespace(
+            transcriptions=types.SimpleNamespace(create=self._transcribe))
+
+    @classmethod
+    def from_env(cls):
+        script = None
+        script_path = os.getenv("FAKE_LLM_SCRIPT")
+        if script_path:
+            with open(script_path, "r", encoding="utf-8") as f:
+                script = json.load(f)
+        return cls(
+            latency=float(os.getenv("FAKE_LLM_LATENCY", "0.5")),
+            jitter=float(os.getenv("FAKE_LLM_JITTER", "0")),
+            script=script,
+        )
+
+    def _sleep(self):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0)
+        time.sleep(delay)
+
+    def _answer(self, messages):
+        last = messages[-1].get("content") or ""
+        for pattern, response in self.script:
+            if pattern.search(last) or pattern.search(messages[0].get("content") or ""):
+                return response if isinstance(response, str) else json.dumps(
+                    response, ensure_ascii=False)
+
+        # Petición de preguntas en lote: una pregunta por cada campo listado
+        if "Formula una pregunta" in last:
+            fields = [line[2:] for line in last.splitlines() if line.startswith("- ")]
+            if not fields:
+                return "¿Puedes indicarme ese dato?"
+            return json.dumps({f: f"¿Cuál es {f.lower()}?" for f in fields}, ensure_ascii=False)
+        return "{}"
+
+    def _chat(self, model, messages, max_tokens=None, tools=None, **kwargs):
+        self._sleep()
+        content = self._answer(messages)
+        prompt_tokens = messages_tokens(messages)
+        completion_tokens = estimate_tokens(content)
+
+        if tools:
+            call = types.SimpleNamespace(
+                id="call_fake",
+                type="function",
+                function=types.SimpleNamespace(
+                    name=tools[0]["function"]["name"], arguments=content),
+            )
+            return _completion(None, [call], prompt_tokens, completion_tokens)
+        return _completion(content, None, prompt_tokens, completion_tokens)
+
+    def _transcribe(self, model, file, language=None, **kwargs):
+        self._sleep()
+        _, stream, _ = file if isinstance(file, tuple) else (None, file, None)
+        digest = hashlib.sha256(stream.read()).hexdigest()[:12]
+        return types.SimpleNamespace(text=f"Transcripción simulada {digest}")
@@ -0,0 +1,108 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+
+
+logger = logging.getLogger("question_store")
+
+class QuestionStore:
+    """Almacén en memoria de preguntas generadas por campo, persistido en disco.
+
+    El catálogo de campos del ERP casi no cambia, así que cada pregunta se
+    genera una sola vez y después se sirve directamente desde memoria.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._questions = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self._questions = {str(k): str(v) for k, v in data.items()}
+        except (OSError, ValueError) as e:
+            logger.error("No se pudo cargar el almacén de preguntas %s: %s", self.path, e)
+
+    def _persist(self):
+        if not self.path:
+            return
+        # Escritura atómica: fichero temporal en el mismo directorio + replace
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self._questions, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error("No se pudo guardar el almacén de preguntas %s: %s", self.path, e)
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def get(self, field):
+        with self._lock:
+            question = self._questions.get(field)
+            if question is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return question
+
+    def split(self, fields):
+        """Separa los campos en (preguntas ya conocidas, campos pendientes)."""
+        found = {}
+        missing = []
+        with self._lock:
+            for field in fields:
+                question = self._questions.get(field)
+                if question is None:
+                    if field not in missing:
+                        missing.append(field)
+                else:
+                    found[field] = question
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, questions):
+        if not questions:
+            return
+        with self._lock:
+            self._questions.update(questions)
+            self._persist()
+
+    def invalidate(self, fields=None):
+        """Elimina los campos indicados, o todo el almacén si no se indican."""
+        with self._lock:
+            if fields is None:
+                removed = len(self._questions)
+                self._questions.clear()
+            else:
+                removed = 0
+                for field in fields:
+                    if self._questions.pop(field, None) is not None:
+                        removed += 1
+            self._persist()
+            return removed
+
+    def fields(self):
+        with self._lock:
+            return list(self._questions)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._questions),
+                "hits": self.hits,
+                "misses": self.misses,
+                "path": self.path,
+            }
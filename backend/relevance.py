@@ -0,0 +1,182 @@
+import json
+import math
+import re
+import threading
+import unicodedata
+from functools import lru_cache
+
+from structured_extraction import OPTIONS_RE
+
+
+# Palabras sin valor para decidir si un campo tiene que ver con el mensaje
+STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante aqui asi cada como con cual
+cuales cuando de del desde donde durante el ella ellas ellos en entre es esa
+esas ese eso esos esta estan estas este esto estos fue ha hay la las le les lo
+los mas me mi mis muy nada ni no nos o otra otro para pero poco por porque que
+quiere quiero se sea ser si sin sobre son su sus tambien tan tener tiene tengo
+todo todos tu un una unas uno unos usted ya y yo
+""".split())
+
+# Grupos de términos equivalentes en las descripciones de proyectos agrícolas
+DEFAULT_SYNONYMS = [
+    ["ancho", "anchura", "luz", "vano"],
+    ["largo", "longitud", "fondo"],
+    ["alto", "altura", "cumbrera"],
+    ["superficie", "area", "hectarea", "m2"],
+    ["invernadero", "nave", "estructura", "multitunel", "tunel", "capilla"],
+    ["ubicacion", "provincia", "municipio", "localidad", "poblacion", "parcela", "finca"],
+    ["cliente", "empresa", "propietario", "agricultor"],
+    ["riego", "goteo", "fertirrigacion", "aspersion", "nebulizacion"],
+    ["cubierta", "plastico", "film", "policarbonato", "vidrio", "malla"],
+    ["ventilacion", "ventana", "cenital", "lateral"],
+    ["calefaccion", "caldera", "climatizacion", "temperatura"],
+    ["cultivo", "plantacion", "tomate", "pimiento", "pepino", "fresa", "flor"],
+    ["presupuesto", "precio", "importe", "coste", "euros"],
+    ["plazo", "fecha", "entrega", "montaje"],
+]
+
+
+def normalize(text):
+    """Minúsculas y sin tildes, para comparar 'Ubicación' con 'ubicacion'."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def stem(word):
+    """Raíz aproximada: sin plural y recortada, para agrupar variantes."""
+    if len(word) > 4 and word.endswith("es"):
+        word = word[:-2]
+    elif len(word) > 3 and word.endswith("s"):
+        word = word[:-1]
+    return word[:6]
+
+
+def load_synonyms(path):
+    """Carga grupos de sinónimos desde un JSON: [["ancho", "anchura"], ...]."""
+    if not path:
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class RelevanceIndex:
+    """Índice de términos de un catálogo de campos con pesos TF-IDF.
+
+    Cada campo se representa por los términos de su descripción y, con menos
+    peso, los de sus opciones. La relevancia de un campo para un mensaje es la
+    similitud coseno entre ambos conjuntos de términos ponderados.
+    """
+
+    def __init__(self, fields, synonyms=(), option_weight=0.5):
+        self._canonical = {}
+        for group in synonyms:
+            canonical = None
+            for phrase in group:
+                for term in self._raw_terms(phrase):
+                    canonical = canonical or term
+                    self._canonical.setdefault(term, canonical)
+
+        field_terms = []
+        for field in fields:
+            match = OPTIONS_RE.search(field)
+            description = field[:match.start()] if match else field
+            weights = {term: 1.0 for term in self.terms(description)}
+            if match:
+                for term in self.terms(match.group("options")):
+                    weights.setdefault(term, option_weight)
+            field_terms.append(weights)
+
+        # IDF: los términos que aparecen en casi todos los campos discriminan poco
+        document_frequency = {}
+        for weights in field_terms:
+            for term in weights:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+        total = len(fields)
+        self.idf = {
+            term: math.log((1 + total) / (1 + count)) + 1.0
+            for term, count in document_frequency.items()
+        }
+
+        self.vectors = []
+        for weights in field_terms:
+            vector = {term: weight * self.idf[term] for term, weight in weights.items()}
+            norm = math.sqrt(sum(v * v for v in vector.values()))
+            self.vectors.append((vector, norm))
+
+    @staticmethod
+    def _raw_terms(text):
+        return [
+            stem(word) for word in re.findall(r"[a-z0-9]+", normalize(text))
+            # Las cifras sueltas coinciden con cualquier campo numerado: se ignoran
+            if word not in STOPWORDS and len(word) > 1 and not word.isdigit()
+        ]
+
+    def terms(self, text):
+        return [self._canonical.get(term, term) for term in self._raw_terms(text)]
+
+    def scores(self, text):
+        """Relevancia (0 a 1) de cada campo para el texto, en el orden del catálogo."""
+        query = {term: self.idf[term] for term in set(self.terms(text)) if term in self.idf}
+        query_norm = math.sqrt(sum(v * v for v in query.values()))
+        if not query_norm:
+            return [0.0] * len(self.vectors)
+
+        scores = []
+        for vector, norm in self.vectors:
+            dot = sum(weight * query[term] for term, weight in vector.items() if term in query)
+            scores.append(dot / (norm * query_norm) if dot else 0.0)
+        return scores
+
+
+class RelevanceFilter:
+    """Selecciona los campos que el mensaje del usuario puede responder.
+
+    Se envían al modelo los top_k campos con relevancia mayor o igual que
+    threshold, más los obligatorios (los indicados en la petición y los que
+    contienen alguno de los textos de always_fields). El índice de cada
+    catálogo se construye una vez y se reutiliza.
+    """
+
+    def __init__(self, top_k=40, threshold=0.1, always_fields=(), synonyms=None,
+                 option_weight=0.5, cached_catalogues=32):
+        self.top_k = top_k
+        self.threshold = threshold
+        self.always_fields = [normalize(f) for f in always_fields if f]
+        self.synonyms = DEFAULT_SYNONYMS if synonyms is None else synonyms
+        self.option_weight = option_weight
+        self._lock = threading.Lock()
+        self._index_for = lru_cache(maxsize=cached_catalogues)(self._build_index)
+
+    def _build_index(self, fields):
+        return RelevanceIndex(fields, self.synonyms, self.option_weight)
+
+    def index_for(self, fields):
+        with self._lock:
+            return self._index_for(tuple(fields))
+
+    def is_always_required(self, field):
+        field = normalize(field)
+        return any(pattern in field for pattern in self.always_fields)
+
+    def select(self, fields, text, required=()):
+        """Devuelve (campos seleccionados en su orden original, puntuación por campo)."""
+        if not fields:
+            return [], {}
+        scores = self.index_for(fields).scores(text)
+
+        required = set(required)
+        ranked = sorted(
+            (i for i, score in enumerate(scores) if score >= self.threshold),
+            key=lambda i: scores[i],
+            reverse=True,
+        )
+        selected = set(ranked[:self.top_k])
+        selected.update(
+            i for i, field in enumerate(fields)
+            if field in required or self.is_always_required(field)
+        )
+        return (
+            [field for i, field in enumerate(fields) if i in selected],
+            {field: round(score, 4) for field, score in zip(fields, scores)},
+        )
@@ -0,0 +1,142 @@
+import json
+import re
+
+
+# Valores que el modelo devuelve cuando no tiene un dato real
+UNWANTED_VALUES = frozenset(value.lower() for value in [
+    # Valores negativos o indeterminados
+    "no mencionado", "no especificado", "no disponible", "no indicado",
+    "desconocido", "sin especificar", "n/a", "na", "no aplica",
+    "-- selecciona --", "seleccione", "selecciona",
+    "no se especifica", "por determinar", "por definir",
+
+    # Valores vacíos o genéricos
+    "false", "true", "none", "null", "undefined", "ninguno", "ninguna",
+    "dato no proporcionado", "información no disponible", "vacio", "vacío",
+    "no hay datos", "pendiente", "a confirmar",
+
+    # Valores imprecisos o no informativos
+    "normal", "estándar", "estandar", "regular", "común", "comun",
+    "varios", "multiple", "multiples", "múltiples"
+])
+
+# Subcadenas que invalidan un valor aunque vaya acompañado de más texto
+UNWANTED_SUBSTRINGS = (
+    "no mencionado", "no especificado", "ninguno", "no disponible"
+)
+
+
+class FieldRule:
+    """Regla para los campos cuyo nombre contiene 'match'.
+
+    Si 'allowed' tiene opciones, los valores se devuelven con la grafía exacta
+    de la opción que coincide (sin distinguir mayúsculas) o, si no hay ninguna
+    exacta, de la única opción que lo contiene o que está contenida en él
+    ("En firme" -> "B (En firme)"). Si no se puede decidir, el valor pasa sin
+    cambios y el frontend lo sigue emparejando por su cuenta.
+    """
+
+    def __init__(self, match, allowed=None):
+        self.match = match
+        self.allowed = list(allowed or [])
+        self._allowed_lookup = {option.lower(): option for option in self.allowed}
+
+    def prompt_hint(self):
+        if not self.allowed:
+            return ""
+        options = ", ".join(f"'{option}'" for option in self.allowed)
+        return f" (opciones válidas exactas: {options})"
+
+    def apply(self, value):
+        """Devuelve el valor normalizado, o None si la regla lo rechaza."""
+        if not self._allowed_lookup or not isinstance(value, str):
+            return value
+        normalized = value.strip().lower()
+        exact = self._allowed_lookup.get(normalized)
+        if exact is not None or not normalized:
+            return exact
+        partial = [
+            option for lowered, option in self._allowed_lookup.items()
+            if normalized in lowered or lowered in normalized
+        ]
+        return partial[0] if len(partial) == 1 else value
+
+
+DEFAULT_FIELD_RULES = [
+    FieldRule("Tipo De Oferta", ["B (En firme)", "A (Estimada)", "NINGUNO"]),
+]
+
+
+def load_field_rules(path):
+    """Carga reglas desde un JSON: [{"match": "...", "allowed": [...]}, ...]."""
+    if not path:
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        rules = json.load(f)
+    return [FieldRule(rule["match"], rule.get("allowed")) for rule in rules]
+
+
+class ResponseSanitizer:
+    """Filtra los valores extraídos por el modelo en una sola pasada por campo.
+
+    Las listas de rechazo se precalculan una vez: búsqueda exacta en un
+    frozenset y una única expresión regular para las subcadenas.
+    """
+
+    def __init__(self, unwanted_values=UNWANTED_VALUES,
+                 unwanted_substrings=UNWANTED_SUBSTRINGS, field_rules=None):
+        self.unwanted_values = frozenset(v.lower() for v in unwanted_values)
+        self._substring_re = re.compile(
+            "|".join(re.escape(s.lower()) for s in unwanted_substrings)
+        ) if unwanted_substrings else None
+        self.field_rules = list(
+            DEFAULT_FIELD_RULES if field_rules is None else field_rules)
+        # Memoria de qué regla corresponde a cada nombre de campo
+        self._rule_cache = {}
+
+    def rule_for(self, field):
+        try:
+            return self._rule_cache[field]
+        except KeyError:
+            pass
+        rule = next((r for r in self.field_rules if r.match in field), None)
+        # El modelo puede inventar claves: evitar que la memoria crezca sin límite
+        if len(self._rule_cache) >= 4096:
+            self._rule_cache.clear()
+        self._rule_cache[field] = rule
+        return rule
+
+    def accept_string(self, value):
+        # Normalizar: minúsculas, sin puntuación
+        normalized = value.lower().strip().strip('.').strip(',')
+
+        # Rechazar valores muy cortos no numéricos (probablemente no son respuestas válidas)
+        if len(normalized) < 2 and not normalized.isdigit():
+            return False
+
+        # Rechazar valores no deseados o que contienen subcadenas no deseadas
+        if normalized in self.unwanted_values:
+            return False
+        if self._substring_re is not None and self._substring_re.search(normalized):
+            return False
+        return True
+
+    def sanitize(self, extracted_json):
+        """Devuelve solo los campos con valores válidos."""
+        filtered_json = {}
+        for field, value in extracted_json.items():
+            if isinstance(value, str):
+                if not self.accept_string(value):
+                    continue
+            elif value is None or value == False:
+                # Para valores booleanos, sólo incluir True (False a menudo es valor por defecto)
+                continue
+
+            rule = self.rule_for(field)
+            if rule is not None:
+                value = rule.apply(value)
+                if value is None:
+                    continue
+
+            filtered_json[field] = value
+        return filtered_json
@@ -0,0 +1,103 @@
+"""Servidor de producción basado en gevent.
+
+Con monkey-patching, cada petición se atiende en un greenlet: mientras una
+llamada larga a OpenAI o al ERP espera la red, el mismo proceso sigue
+atendiendo otras peticiones. Mantiene la conversión PFX → PEM para TLS.
+
+Uso (desde backend/):
+    python server.py
+
+Variables de entorno:
+    SERVER_HOST, SERVER_PORT    dirección de escucha (0.0.0.0:5002)
+    SERVER_WORKERS              procesos que comparten el socket (1)
+    SERVER_CONCURRENCY          peticiones simultáneas por proceso (1000)
+    SERVER_SSL                  '0' para servir sin TLS (1)
+
+Con más de un proceso, las sesiones en memoria no se comparten: usar
+SESSION_BACKEND=sqlite o redis.
+"""
+# El parcheo debe hacerse antes de importar cualquier módulo que use sockets
+from gevent import monkey
+
+monkey.patch_all()
+
+import os  # noqa: E402
+import signal  # noqa: E402
+
+import gevent  # noqa: E402
+from gevent import socket  # noqa: E402
+from gevent.pool import Pool  # noqa: E402
+from gevent.pywsgi import WSGIServer  # noqa: E402
+
+from certificates import build_ssl_context  # noqa: E402
+
+
+HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+PORT = int(os.getenv("SERVER_PORT", "5002"))
+WORKERS = max(1, int(os.getenv("SERVER_WORKERS", "1")))
+CONCURRENCY = max(1, int(os.getenv("SERVER_CONCURRENCY", "1000")))
+USE_SSL = os.getenv("SERVER_SSL", "1") == "1"
+
+
+def serve(listener, ssl_context):
+    # La aplicación se importa en cada proceso para que cada worker tenga su
+    # propio estado (clientes HTTP, hilos de limpieza, cachés en memoria)
+    from app import app
+
+    ssl_args = {"ssl_context": ssl_context} if ssl_context else {}
+    server = WSGIServer(listener, app, spawn=Pool(CONCURRENCY), **ssl_args)
+    # Parada ordenada: deja de aceptar conexiones y termina las peticiones en curso
+    gevent.signal_handler(signal.SIGTERM, server.stop)
+    server.serve_forever()
+
+
+def open_listener():
+    # El socket se abre antes de crear los workers para que todos lo compartan
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((HOST, PORT))
+    listener.listen(1024)
+    return listener
+
+
+def main():
+    ssl_context = None
+    if USE_SSL:
+        try:
+            ssl_context, pem_path = build_ssl_context()
+            # El contexto ya ha leído clave y certificados: el PEM no hace falta
+            os.unlink(pem_path)
+        except Exception as e:
+            print(f"❌ Error al cargar PFX: {e}")
+            print("🟡 Iniciando sin SSL…")
+
+    listener = open_listener()
+
+    scheme = "https" if ssl_context else "http"
+    print(f"🚀 Servidor gevent en {scheme}://{HOST}:{PORT} "
+          f"({WORKERS} procesos, {CONCURRENCY} peticiones simultáneas por proceso)")
+
+    children = []
+    for _ in range(WORKERS - 1):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                serve(listener, ssl_context)
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    try:
+        serve(listener, ssl_context)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,454 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+try:
+    from redis.exceptions import WatchError
+except ImportError:  # Sin el paquete redis, FakeRedis usa su propia excepción
+    class WatchError(Exception):
+        """Una clave vigilada con WATCH cambió antes de EXEC."""
+
+
+logger = logging.getLogger("session_store")
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def new_session(answers=None):
+    timestamp = now_iso()
+    return {
+        "answers": dict(answers or {}),
+        # Valores extraídos por el modelo con su procedencia, y turno de extracción
+        "extracted": {},
+        "turn": 0,
+        "started_at": timestamp,
+        "updated_at": timestamp,
+    }
+
+
+def encode(session):
+    return json.dumps(session, ensure_ascii=False, separators=(",", ":"))
+
+
+class BaseSessionStore:
+    """Interfaz común de los almacenes de sesiones.
+
+    Las sesiones son diccionarios serializables a JSON con 'answers',
+    'started_at' y 'updated_at'. update() aplica una función que modifica la
+    sesión en sitio y la guarda de forma atómica dentro del proceso.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    def get(self, session_id):
+        raw = self._load(session_id)
+        return json.loads(raw) if raw is not None else None
+
+    def put(self, session_id, session):
+        with self._lock:
+            self._save(session_id, encode(session))
+
+    def update(self, session_id, mutate, create=False):
+        """Aplica mutate(session) y guarda el resultado. Devuelve la sesión o None."""
+        with self._lock:
+            raw = self._load(session_id)
+            if raw is None:
+                if not create:
+                    return None
+                session = new_session()
+            else:
+                session = json.loads(raw)
+            mutate(session)
+            session["updated_at"] = now_iso()
+            self._save(session_id, encode(session))
+            return session
+
+    def exists(self, session_id):
+        return self._load(session_id) is not None
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def purge_expired(self):
+        return 0
+
+    def stats(self):
+        return {
+            "backend": type(self).__name__,
+            "sessions": self.count(),
+            "bytes": self.size_bytes(),
+            "evictions": self.evictions,
+            "ttl": self.ttl,
+        }
+
+    def _load(self, session_id):
+        raise NotImplementedError
+
+    def _save(self, session_id, raw):
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def size_bytes(self):
+        raise NotImplementedError
+
+
+class MemorySessionStore(BaseSessionStore):
+    """Sesiones en memoria con expulsión LRU, caducidad TTL y límites de tamaño."""
+
+    def __init__(self, ttl, max_sessions=10000, max_bytes=64 * 1024 * 1024):
+        super().__init__(ttl)
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        # session_id -> (expires_at, raw)
+        self._data = OrderedDict()
+        self._bytes = 0
+
+    def _load(self, session_id):
+        with self._lock:
+            entry = self._data.get(session_id)
+            if entry is None:
+                return None
+            expires_at, raw = entry
+            if expires_at < time.time():
+                self._remove(session_id)
+                return None
+            self._data.move_to_end(session_id)
+            return raw
+
+    def _save(self, session_id, raw):
+        with self._lock:
+            self._remove(session_id)
+            self._data[session_id] = (time.time() + self.ttl, raw)
+            self._bytes += len(raw)
+            # Expulsar las sesiones menos usadas hasta respetar los límites
+            while len(self._data) > 1 and (
+                    len(self._data) > self.max_sessions or self._bytes > self.max_bytes):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, session_id):
+        entry = self._data.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def delete(self, session_id):
+        with self._lock:
+            self._remove(session_id)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, (expires_at, _) in self._data.items() if expires_at < now]
+            for session_id in expired:
+                self._remove(session_id)
+            return len(expired)
+
+    def count(self):
+        with self._lock:
+            return len(self._data)
+
+    def size_bytes(self):
+        with self._lock:
+            return self._bytes
+
+
+class SQLiteSessionStore(BaseSessionStore):
+    """Sesiones en SQLite para despliegues de un solo nodo con varios workers."""
+
+    def __init__(self, ttl, path="sessions.db"):
+        super().__init__(ttl)
+        self.path = path
+        # Modo autocommit: las transacciones se abren explícitamente en update()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, timeout=30, isolation_level=None)
+        with self._lock:
+            # WAL permite que varios procesos lean mientras otro escribe
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def update(self, session_id, mutate, create=False):
+        # BEGIN IMMEDIATE bloquea a otros procesos durante la lectura-modificación-escritura
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                session = super().update(session_id, mutate, create=create)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return session
+
+    def _load(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, expires_at FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[0]
+
+    def _save(self, session_id, raw):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)",
+                (session_id, raw, time.time() + self.ttl),
+            )
+
+    def delete(self, session_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def purge_expired(self):
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM sessions WHERE expires_at < ?", (time.time(),))
+            return cursor.rowcount
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM sessions WHERE expires_at >= ?", (time.time(),)
+            ).fetchone()[0]
+
+    def size_bytes(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(data)), 0) FROM sessions WHERE expires_at >= ?",
+                (time.time(),),
+            ).fetchone()[0]
+
+
+class FakeRedis:
+    """Sustituto local de Redis con el subconjunto de comandos que usa el almacén.
+
+    Incluye WATCH/MULTI/EXEC mediante pipeline(), con la misma semántica que
+    redis-py: execute() lanza WatchError si alguna clave vigilada ha cambiado.
+    """
+
+    def __init__(self):
+        self._data = {}
+        # Versión de cada clave, para detectar cambios entre WATCH y EXEC
+        self._versions = {}
+        self._lock = threading.RLock()
+
+    def _alive(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.time():
+            del self._data[key]
+            self._touch(key)
+            return None
+        return value
+
+    def _touch(self, key):
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    def version(self, key):
+        with self._lock:
+            self._alive(key)
+            return self._versions.get(key, 0)
+
+    def get(self, key):
+        with self._lock:
+            return self._alive(key)
+
+    def set(self, key, value, ex=None):
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        with self._lock:
+            self._data[key] = (value, time.time() + ex if ex else None)
+            self._touch(key)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            removed = 0
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self._touch(key)
+                    removed += 1
+            return removed
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def scan_iter(self, match=None):
+        prefix = match[:-1] if match and match.endswith("*") else match
+        with self._lock:
+            keys = [k for k in list(self._data) if self._alive(k) is not None]
+        return iter([k for k in keys if prefix is None or k.startswith(prefix)])
+
+
+class FakePipeline:
+    """Pipeline de FakeRedis: comandos inmediatos tras watch(), en cola tras multi()."""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self._watched = {}
+        self._queue = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.reset()
+
+    def reset(self):
+        self._watched = {}
+        self._queue = None
+
+    def watch(self, *keys):
+        for key in keys:
+            self._watched[key] = self.redis.version(key)
+
+    def multi(self):
+        self._queue = []
+
+    def get(self, key):
+        return self.redis.get(key)
+
+    def set(self, key, value, ex=None):
+        if self._queue is None:
+            return self.redis.set(key, value, ex=ex)
+        self._queue.append((key, value, ex))
+        return self
+
+    def execute(self):
+        with self.redis._lock:
+            try:
+                for key, version in self._watched.items():
+                    if self.redis.version(key) != version:
+                        raise WatchError(f"La clave vigilada {key} ha cambiado")
+                return [self.redis.set(key, value, ex=ex) for key, value, ex in self._queue or ()]
+            finally:
+                self.reset()
+
+
+class RedisSessionStore(BaseSessionStore):
+    """Sesiones en Redis (o cualquier cliente compatible), compartidas entre nodos.
+
+    La caducidad la gestiona Redis con el TTL de cada clave. update() usa
+    bloqueo optimista (WATCH/MULTI/EXEC): si otro proceso modifica la sesión
+    entre la lectura y la escritura, se vuelve a leer y se aplica de nuevo la
+    función, así que esta no debe tener efectos fuera de la sesión.
+    """
+
+    def __init__(self, ttl, client, prefix="session:", max_retries=50):
+        super().__init__(ttl)
+        self.client = client
+        self.prefix = prefix
+        self.max_retries = max_retries
+        self.conflicts = 0
+
+    def _key(self, session_id):
+        return f"{self.prefix}{session_id}"
+
+    def update(self, session_id, mutate, create=False):
+        key = self._key(session_id)
+        for _ in range(self.max_retries):
+            with self.client.pipeline() as pipe:
+                try:
+                    pipe.watch(key)
+                    raw = pipe.get(key)
+                    if raw is None:
+                        if not create:
+                            return None
+                        session = new_session()
+                    else:
+                        session = json.loads(raw)
+                    mutate(session)
+                    session["updated_at"] = now_iso()
+                    pipe.multi()
+                    pipe.set(key, encode(session), ex=self.ttl)
+                    pipe.execute()
+                    return session
+                except WatchError:
+                    # Otro proceso escribió la sesión: reintentar con su versión
+                    self.conflicts += 1
+        raise RuntimeError(
+            f"No se pudo actualizar la sesión {session_id} tras {self.max_retries} intentos")
+
+    def stats(self):
+        stats = super().stats()
+        stats["conflicts"] = self.conflicts
+        return stats
+
+    def _load(self, session_id):
+        raw = self.client.get(self._key(session_id))
+        if raw is None:
+            return None
+        return raw.decode("utf-8") if isinstance(raw, bytes) else raw
+
+    def _save(self, session_id, raw):
+        self.client.set(self._key(session_id), raw, ex=self.ttl)
+
+    def delete(self, session_id):
+        self.client.delete(self._key(session_id))
+
+    def _keys(self):
+        return list(self.client.scan_iter(match=f"{self.prefix}*"))
+
+    def count(self):
+        return len(self._keys())
+
+    def size_bytes(self):
+        total = 0
+        for key in self._keys():
+            raw = self.client.get(key)
+            if raw is not None:
+                total += len(raw)
+        return total
+
+
+def start_sweeper(store, interval):
+    """Lanza un hilo que elimina periódicamente las sesiones caducadas."""
+
+    def _sweep():
+        while True:
+            time.sleep(interval)
+            try:
+                removed = store.purge_expired()
+                if removed:
+                    logger.info("Sesiones caducadas eliminadas: %d", removed)
+            except Exception as e:
+                logger.error("Error al limpiar sesiones caducadas: %s", e)
+
+    thread = threading.Thread(target=_sweep, name="session-sweeper", daemon=True)
+    thread.start()
+    return thread
+
+
+def build_session_store(backend, ttl, max_sessions=10000, max_bytes=64 * 1024 * 1024,
+                        path="sessions.db", redis_url=None):
+    """Crea el almacén indicado por nombre: 'memory', 'sqlite', 'redis' o 'fakeredis'."""
+    backend = (backend or "memory").lower()
+    if backend == "memory":
+        return MemorySessionStore(ttl, max_sessions=max_sessions, max_bytes=max_bytes)
+    if backend == "sqlite":
+        return SQLiteSessionStore(ttl, path=path)
+    if backend == "fakeredis":
+        return RedisSessionStore(ttl, FakeRedis())
+    if backend == "redis":
+        try:
+            import redis
+        except ImportError as e:
+            raise ValueError("El backend 'redis' necesita el paquete 'redis'") from e
+        return RedisSessionStore(ttl, redis.Redis.from_url(redis_url or "redis://localhost:6379/0"))
+    raise ValueError(f"Backend de sesiones desconocido: {backend}")
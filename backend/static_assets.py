@@ -0,0 +1,270 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import sys
+import threading
+
+from flask import Response
+from werkzeug.wsgi import wrap_file
+
+try:
+    import brotli
+except ImportError:  # Brotli es opcional: sin él solo se sirve gzip
+    brotli = None
+
+
+# Ficheros con hash de contenido que genera Vite en assets/: assets/index-4DXFJjLn.js.
+# Lo que se copia de public/ (favicon, logos) conserva su nombre y no es inmutable.
+HASHED_NAME_RE = re.compile(r"^assets/.+-[A-Za-z0-9_-]{8}\.\w+$")
+
+# Manifiesto de Vite (build.manifest): si existe, dice exactamente qué ficheros llevan hash
+MANIFEST_PATHS = (".vite/manifest.json", "manifest.json")
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json",
+                      "application/xml", "image/svg+xml", "application/wasm")
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+# Orden de preferencia cuando el cliente acepta varias codificaciones por igual
+ENCODINGS = ("br", "gzip")
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def is_compressible(mimetype):
+    return mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def parse_accept_encoding(header):
+    """Devuelve {codificación: q} a partir de la cabecera Accept-Encoding."""
+    accepted = {}
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+    return accepted
+
+
+def etag_matches(header, etag):
+    """Comprueba If-None-Match, incluidas las etiquetas débiles y '*'."""
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class Variant:
+    """Una representación del fichero: original, gzip o brotli."""
+
+    __slots__ = ("encoding", "etag", "length", "data", "path")
+
+    def __init__(self, encoding, etag, length, data=None, path=None):
+        self.encoding = encoding
+        self.etag = etag
+        self.length = length
+        self.data = data
+        self.path = path
+
+
+class Asset:
+    __slots__ = ("mimetype", "cache_control", "variants")
+
+    def __init__(self, mimetype, cache_control, variants):
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.variants = variants
+
+
+class StaticAssets:
+    """Índice en memoria de los ficheros del frontend compilado.
+
+    Recorre el directorio una vez (y en cada reload()) en lugar de consultar
+    el disco en cada petición. Para los tipos de texto usa las variantes .br y
+    .gz que existan junto al fichero y, si falta la gzip, la genera en memoria.
+    Los ficheros con hash que genera Vite se sirven como inmutables; el resto
+    se revalida con ETag.
+    """
+
+    def __init__(self, root, index="index.html", memory_limit=4 * 1024 * 1024,
+                 min_compress_bytes=1024):
+        self.root = root
+        self.index = index
+        self.memory_limit = memory_limit
+        self.min_compress_bytes = min_compress_bytes
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def _manifest_files(self):
+        """Ficheros con hash según el manifiesto de Vite, o None si no hay manifiesto."""
+        for name in MANIFEST_PATHS:
+            path = os.path.join(self.root, name)
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            files = set()
+            for chunk in manifest.values():
+                files.add(chunk["file"])
+                files.update(chunk.get("css", ()))
+                files.update(chunk.get("assets", ()))
+            return files
+        return None
+
+    def is_hashed(self, relative, manifest_files=None):
+        if manifest_files is not None:
+            return relative in manifest_files
+        return bool(HASHED_NAME_RE.match(relative))
+
+    def reload(self):
+        """Vuelve a indexar el directorio. Devuelve el número de ficheros."""
+        assets = {}
+        if os.path.isdir(self.root):
+            manifest_files = self._manifest_files()
+            for directory, _, files in os.walk(self.root):
+                for name in files:
+                    if name.endswith((".gz", ".br")):
+                        continue
+                    path = os.path.join(directory, name)
+                    relative = os.path.relpath(path, self.root).replace(os.sep, "/")
+                    assets[relative] = self._load(
+                        path, self.is_hashed(relative, manifest_files))
+        with self._lock:
+            self._assets = assets
+        return len(assets)
+
+    def _load(self, path, hashed):
+        # Flask añade '; charset=utf-8' a los tipos de texto
+        mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        cache_control = IMMUTABLE_CACHE if hashed else REVALIDATE_CACHE
+
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:20]
+        in_memory = len(data) <= self.memory_limit
+
+        variants = {None: Variant(
+            None, f'"{digest}"', len(data),
+            data=data if in_memory else None, path=None if in_memory else path)}
+
+        if is_compressible(mimetype) and len(data) >= self.min_compress_bytes:
+            for encoding in ENCODINGS:
+                compressed_path = path + SUFFIXES[encoding]
+                if os.path.exists(compressed_path):
+                    with open(compressed_path, "rb") as f:
+                        compressed = f.read()
+                elif encoding == "gzip":
+                    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+                else:
+                    continue
+                # Una variante que no ahorra nada solo añade trabajo al cliente
+                if len(compressed) < len(data):
+                    variants[encoding] = Variant(
+                        encoding, f'"{digest}-{encoding}"', len(compressed), data=compressed)
+
+        return Asset(mimetype, cache_control, variants)
+
+    def lookup(self, path):
+        with self._lock:
+            return self._assets.get(path)
+
+    def stats(self):
+        with self._lock:
+            assets = list(self._assets.values())
+        return {
+            "root": self.root,
+            "files": len(assets),
+            "bytes": sum(a.variants[None].length for a in assets),
+            "compressed_variants": sum(len(a.variants) - 1 for a in assets),
+        }
+
+    def resolve(self, path):
+        """Fichero que corresponde a la ruta, con la aplicación como respaldo.
+
+        Las rutas sin extensión son rutas del cliente y devuelven index.html;
+        un fichero con extensión que no existe es un 404, no la aplicación.
+        """
+        asset = self.lookup(path) if path else None
+        if asset is not None:
+            return asset
+        if "." in path.rsplit("/", 1)[-1]:
+            return None
+        return self.lookup(self.index)
+
+    def response(self, request, path):
+        asset = self.resolve(path)
+        if asset is None:
+            return None
+
+        variant = asset.variants[None]
+        if len(asset.variants) > 1:
+            accepted = parse_accept_encoding(request.headers.get("Accept-Encoding"))
+            best_q = 0
+            for encoding in ENCODINGS:
+                q = accepted.get(encoding, accepted.get("*", 0))
+                if encoding in asset.variants and q > best_q:
+                    variant, best_q = asset.variants[encoding], q
+
+        headers = {
+            "Cache-Control": asset.cache_control,
+            "ETag": variant.etag,
+        }
+        if len(asset.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+
+        if etag_matches(request.headers.get("If-None-Match"), variant.etag):
+            return Response(status=304, headers=headers)
+
+        if variant.encoding:
+            headers["Content-Encoding"] = variant.encoding
+        headers["Content-Length"] = str(variant.length)
+
+        if variant.data is not None:
+            body = variant.data
+        else:
+            body = wrap_file(request.environ, open(variant.path, "rb"))
+        return Response(body, mimetype=asset.mimetype, headers=headers,
+                        direct_passthrough=variant.data is None)
+
+
+def precompress(root, min_compress_bytes=1024):
+    """Escribe junto a cada fichero de texto sus variantes .gz (y .br si hay brotli)."""
+    written = 0
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if name.endswith((".gz", ".br")):
+                continue
+            path = os.path.join(directory, name)
+            mimetype = mimetypes.guess_type(path)[0] or ""
+            if not is_compressible(mimetype) or os.path.getsize(path) < min_compress_bytes:
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            outputs = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                outputs[".br"] = brotli.compress(data, quality=11)
+            for suffix, compressed in outputs.items():
+                with open(path + suffix, "wb") as f:
+                    f.write(compressed)
+                written += 1
+    return written
+
+
+if __name__ == "__main__":
+    # Tras compilar el frontend: python static_assets.py static
+    target = sys.argv[1] if len(sys.argv) > 1 else "static"
+    print(f"Variantes comprimidas escritas: {precompress(target)}")
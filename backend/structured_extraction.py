@@ -0,0 +1,95 @@
+import re
+from functools import lru_cache
+from typing import Literal, Optional, Union
+
+from pydantic import ConfigDict, Field, create_model
+
+
+# Opciones que el frontend añade a las preguntas de selección: "Campo (opciones: a, b, c)"
+OPTIONS_RE = re.compile(r"\(opciones:\s*(?P<options>.*)\)\s*$", re.IGNORECASE)
+
+TOOL_NAME = "registrar_campos"
+
+FreeValue = Union[bool, int, float, str]
+
+
+def field_options(field, sanitizer=None):
+    """Devuelve las opciones válidas de un campo, o una lista vacía si es libre."""
+    rule = sanitizer.rule_for(field) if sanitizer is not None else None
+    if rule is not None and rule.allowed:
+        return list(rule.allowed)
+
+    match = OPTIONS_RE.search(field)
+    if not match:
+        return []
+    options = [o.strip() for o in match.group("options").split(",")]
+    return list(dict.fromkeys(o for o in options if o))
+
+
+@lru_cache(maxsize=256)
+def build_batch_model(batch, sanitizer=None):
+    """Crea un modelo pydantic con un atributo opcional por campo del lote.
+
+    Los nombres de campo del ERP no son identificadores válidos, así que cada
+    atributo usa un nombre interno y el nombre real como alias. El alias es la
+    descripción sin "(opciones: ...)", que es la clave que busca el frontend;
+    las opciones ya van en el esquema como enumeración.
+    """
+    definitions = {}
+    aliases = set()
+    for i, field in enumerate(batch):
+        options = field_options(field, sanitizer)
+        value_type = Literal[tuple(options)] if options else FreeValue
+        alias = OPTIONS_RE.sub("", field).strip() or field
+        if alias in aliases:
+            # Dos campos con la misma descripción: se distinguen por sus opciones
+            alias = field
+        aliases.add(alias)
+        definitions[f"campo_{i}"] = (
+            Optional[value_type],
+            Field(default=None, alias=alias),
+        )
+
+    return create_model(
+        "CamposExtraidos",
+        __config__=ConfigDict(extra="ignore"),
+        **definitions,
+    )
+
+
+def build_extraction_tool(model):
+    """Definición de la herramienta que obliga al modelo a responder con el esquema."""
+    schema = model.model_json_schema()
+    schema.pop("title", None)
+    return {
+        "type": "function",
+        "function": {
+            "name": TOOL_NAME,
+            "description": (
+                "Registra los campos del proyecto agrícola que aparecen en el texto. "
+                "Omite los campos sin información."
+            ),
+            "parameters": schema,
+        },
+    }
+
+
+def forced_tool_choice():
+    return {"type": "function", "function": {"name": TOOL_NAME}}
+
+
+def tool_arguments(chat_completion):
+    """Devuelve los argumentos JSON de la llamada a la herramienta, o el texto."""
+    message = chat_completion.choices[0].message
+    tool_calls = getattr(message, "tool_calls", None) or []
+    for call in tool_calls:
+        if call.function.name == TOOL_NAME:
+            return call.function.arguments
+    return message.content or ""
+
+
+def validate_arguments(model, arguments):
+    """Valida los argumentos en una sola pasada; lanza ValidationError si no encajan."""
+    instance = model.model_validate_json(arguments)
+    return instance.model_dump(by_alias=True, exclude_none=True)
+
@@ -0,0 +1,55 @@
+import tempfile
+import threading
+
+from flask import Request
+
+from metrics import span
+
+
+class TranscriptionBusy(Exception):
+    """No hay hueco libre para transcribir dentro del tiempo de espera."""
+
+
+def spooled_request_class(spool_bytes):
+    """Crea una clase Request cuyas subidas se guardan en un SpooledTemporaryFile.
+
+    Por debajo de spool_bytes el fichero vive solo en memoria; por encima se
+    vuelca a un fichero temporal anónimo y único por petición, que el sistema
+    borra al cerrarse. Werkzeug escribe directamente en él, sin copias extra.
+    """
+
+    class SpooledUploadRequest(Request):
+        def _get_file_stream(self, total_content_length, content_type,
+                             filename=None, content_length=None):
+            return tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+
+    return SpooledUploadRequest
+
+
+class Transcriber:
+    """Envía audio a la API de transcripción limitando las llamadas simultáneas."""
+
+    def __init__(self, model="whisper-1", language="es", max_concurrency=4,
+                 queue_timeout=30.0):
+        self.model = model
+        self.language = language
+        self.queue_timeout = queue_timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+
+    def transcribe(self, client, stream, filename, content_type=None):
+        """Transcribe el audio del stream (posicionado al inicio) y devuelve el texto."""
+        with span("transcription.queue"):
+            if not self._semaphore.acquire(timeout=self.queue_timeout):
+                raise TranscriptionBusy("Demasiadas transcripciones en curso")
+        try:
+            stream.seek(0)
+            with span("transcription.upstream"):
+                transcript = client.audio.transcriptions.create(
+                    model=self.model,
+                    # (nombre, fichero, tipo): el SDK no necesita una ruta en disco
+                    file=(filename, stream, content_type or "application/octet-stream"),
+                    language=self.language  # Spanish language for better accuracy
+                )
+            return transcript.text
+        finally:
+            self._semaphore.release()
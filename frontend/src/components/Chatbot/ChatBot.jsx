@@ -45,6 +45,7 @@ const ChatInput = ({ value = '', onChange, onSubmit, isTyping, placeholder }) =>
   const mediaRecorderRef = useRef(null);
   const audioChunksRef = useRef([]);
   const timerRef = useRef(null);
+  const recordingStartRef = useRef(null);
 
   // Handle keyboard submission
   const handleKeyDown = (e) => {
@@ -85,6 +86,8 @@ const ChatInput = ({ value = '', onChange, onSubmit, isTyping, placeholder }) =>
           // Create FormData to send the audio file
           const formData = new FormData();
           formData.append('audio', audioBlob, 'recording.webm');
+          // Duración real de la grabación, para que el servidor aplique su límite
+          formData.append('duration', ((Date.now() - recordingStartRef.current) / 1000).toFixed(1));
 
           // Send to backend for transcription
           const response = await fetch(`${LOCAL_API_URL}/transcribe_audio`, {
@@ -120,6 +123,7 @@ const ChatInput = ({ value = '', onChange, onSubmit, isTyping, placeholder }) =>
       };
 
       mediaRecorder.start();
+      recordingStartRef.current = Date.now();
       setIsRecording(true);
 
       // Start recording timer
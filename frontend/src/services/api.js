@@ -94,41 +94,24 @@ export const enviarRespuestas = async (respuestas) => {
   try {
     // Crear un session_id único para esta sesión
     const session_id = `session_${Date.now()}`;
-    
-    // Primero iniciar una sesión
-    const initResponse = await fetch(`${LOCAL_API_URL}/start`, {
+
+    // Crear la sesión y guardar todas las respuestas en una sola petición
+    const response = await fetch(`${LOCAL_API_URL}/answers`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
       },
-      body: JSON.stringify({ 
+      body: JSON.stringify({
         session_id: session_id,
-        existing_answers: {} 
+        answers: respuestas,
+        reset: true
       }),
     });
-    
-    if (!initResponse.ok) {
-      throw new Error(`Error al iniciar sesión: ${initResponse.status}`);
-    }
-    
-    // Enviar cada respuesta en secuencia
-    for (const [_, respuesta] of Object.entries(respuestas)) {
-      const answerResponse = await fetch(`${LOCAL_API_URL}/answer`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          session_id: session_id,
-          answer: respuesta
-        }),
-      });
-      
-      if (!answerResponse.ok) {
-        throw new Error(`Error al enviar respuesta: ${answerResponse.status}`);
-      }
+
+    if (!response.ok) {
+      throw new Error(`Error al enviar respuestas: ${response.status}`);
     }
-    
+
     return { success: true, session_id };
   } catch (error) {
     console.error('Error al enviar respuestas:', error);
@@ -4,6 +4,10 @@ import react from '@vitejs/plugin-react'
 // https://vite.dev/config/
 export default defineConfig({
   plugins: [react()],
+  build: {
+    // El backend lee .vite/manifest.json para saber qué ficheros llevan hash
+    manifest: true,
+  },
   server: {
     proxy: {
       '/api': {